@@ -2,11 +2,13 @@ import os
 
 from config import Config
 from flask import Flask, url_for
-from views import index,  nav
+from views import image, index, nav
 
 from autonomous import log
 from autonomous.auth import AutoAuth
 from models.user import User
+from utils import metrics
+from utils import membership  # noqa: F401 - saves here update app permissions
 
 
 def create_app():
@@ -33,5 +35,8 @@ def create_app():
     #           Blueprints               #
     ######################################
     app.register_blueprint(nav.nav_endpoint, url_prefix="/nav")
+    app.register_blueprint(image.image_endpoint, url_prefix="/image")
     app.register_blueprint(index.index_endpoint, url_prefix="/")
+
+    metrics.install(app)
     return app
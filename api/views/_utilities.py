@@ -1,8 +1,59 @@
-from flask import request
+import os
+
+from bson import ObjectId
+from flask import g, request
 
 from autonomous import log
-from autonomous.model.automodel import AutoModel
 from models.user import User
+from utils.cache import LRUCache
+from utils.registry import model_class
+
+# users are re-read by every htmx fragment of a page view, so they are also
+# kept across requests for a few seconds
+_users = LRUCache(maxsize=1024, ttl=float(os.environ.get("USER_CACHE_TTL", 5)))
+
+
+def _pk_key(pk):
+    if isinstance(pk, dict):
+        pk = pk.get("$oid") or pk.get("pk")
+    return str(pk) if pk else None
+
+
+def _identity_map():
+    if "identity_map" not in g:
+        g.identity_map = {}
+    return g.identity_map
+
+
+def get(Model, pk):
+    """
+    Loads a (model, pk) at most once per request
+    """
+    identity_map = _identity_map()
+    key = (Model.__name__.lower(), _pk_key(pk))
+    if key not in identity_map:
+        obj = _users.get(key[1]) if issubclass(Model, User) else None
+        if not obj:
+            obj = Model.get(key[1]) if key[1] else None
+            if obj and issubclass(Model, User):
+                _users.set(key[1], obj)
+        identity_map[key] = obj
+    return identity_map[key]
+
+
+def get_many(Model, pks):
+    """
+    Loads several pks of one model with a single $in query, reusing any
+    already in the request's identity map
+    """
+    identity_map = _identity_map()
+    keys = [(Model.__name__.lower(), _pk_key(pk)) for pk in pks]
+    if missing := {
+        k[1] for k in keys if k not in identity_map and ObjectId.is_valid(k[1])
+    }:
+        for obj in Model.objects(pk__in=list(missing)):
+            identity_map[(Model.__name__.lower(), str(obj.pk))] = obj
+    return [identity_map.get(k) for k in keys]
 
 
 def loader(
@@ -24,24 +75,11 @@ def loader(
         return None, None, None, None, None
 
     # get user
-    if not user:
-        user_data = request_data.get("user", None)
-        #
-        user = (
-            User.get(user_data["pk"])
-            if isinstance(user_data, dict) and user_data.get("pk")
-            else User.get(user_data)
-        )
-    else:
-        user = User.get(user)
+    user = get(User, user or request_data.get("user", None))
     # log(user)
     # get obj
-    try:
-        Model = AutoModel.load_model(model or request_data.get("model", None))
-        obj = Model.get(pk or request_data.get("pk", None))
-    except ValueError as e:
-        log(e)
-        obj = None
+    Model = model_class(model or request_data.get("model", None))
+    obj = get(Model, pk or request_data.get("pk", None)) if Model else None
     # log(obj)
     # get world
     return user, obj
@@ -0,0 +1,160 @@
+"""
+# Image API Documentation
+
+## Image Endpoints
+
+"""
+
+import os
+
+from bson import ObjectId
+from flask import Blueprint, get_template_attribute, request
+
+from autonomous import log
+from models.image import Image
+from utils.facets import tag_facets
+from utils.membership import membership
+
+from ._utilities import loader as _loader
+
+# the most images one retag request may touch
+_retag_limit = int(os.environ.get("IMAGE_RETAG_LIMIT", 1000))
+# the largest page a gallery request may ask for
+_page_limit = int(os.environ.get("IMAGE_PAGE_LIMIT", 200))
+# the most tags a facets request may ask for
+_facet_limit = int(os.environ.get("IMAGE_FACET_LIMIT", 1000))
+
+image_endpoint = Blueprint("image", __name__)
+
+
+def _limit(value, maximum):
+    """
+    A requested limit as an int capped at `maximum`, or None if none was
+    given; raises ValueError for anything but a positive integer
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not str(value).isdigit() or int(value) < 1:
+        raise ValueError(f"invalid limit {value!r}")
+    return min(int(value), maximum)
+
+
+def _strings(value):
+    """
+    A list of strings from a request body, or [] if none was given; raises
+    ValueError for anything else, rather than iterating a bare string
+    """
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"expected a list of strings, not {value!r}")
+    return value
+
+
+def _can_retag(user, pks):
+    """
+    Admins may retag any image; everyone else only images associated with an
+    object in a world they are a member of (the check the app applies to
+    every other write)
+    """
+    if user.is_admin:
+        return True
+    ids = [ObjectId(str(pk)) for pk in pks if ObjectId.is_valid(str(pk))]
+    # the raw references, so no associated object is loaded on a cache hit
+    docs = {
+        doc["_id"]: doc.get("associations", [])
+        for doc in Image.objects(pk__in=ids).only("associations").as_pymongo()
+    }
+    return all(
+        any(
+            membership.is_member(user, ref["_cls"].split(".")[-1], ref["_ref"].id)
+            for ref in docs.get(pk, [])
+            if isinstance(ref, dict) and ref.get("_cls") and ref.get("_ref")
+        )
+        for pk in ids
+    )
+
+
+@image_endpoint.route("/tags", methods=("POST",))
+def retag():
+    """
+    Retags a selection of images with one update per change:
+    {"user": ..., "pks": [...], "add": [...], "remove": [...]}
+    """
+    user, *_ = _loader()
+    if not user or user.is_guest:
+        return "<p>You do not have permission to alter this object<p>", 403
+    try:
+        pks, add, remove = (
+            _strings(request.json.get(field)) for field in ("pks", "add", "remove")
+        )
+    except ValueError as e:
+        log(f"==== Error: {e} ====")
+        return "<p>pks, add and remove must be lists of strings</p>", 400
+    if len(pks) > _retag_limit:
+        return f"<p>Select at most {_retag_limit} images to retag</p>", 400
+    if not _can_retag(user, pks):
+        return "<p>You do not have permission to alter this object<p>", 403
+    changed = Image.retag(pks, add=add, remove=remove)
+    return {"changed": changed, "selected": len(pks)}
+
+
+@image_endpoint.route("/facets", methods=("GET", "POST"))
+def facets():
+    """
+    Image counts per tag, most used first. With tags, the counts are of the
+    other tags on images having all of them:
+    {"tags": [...], "limit": n} -> {"total": n, "facets": [[tag, count], ...]}
+    """
+    if request.method == "GET":
+        tags, limit = request.args.getlist("tags"), request.args.get("limit")
+    else:
+        tags, limit = request.json.get("tags"), request.json.get("limit")
+    try:
+        limit = _limit(limit, _facet_limit)
+    except ValueError as e:
+        log(f"==== Error: {e} ====")
+        return {"error": "limit must be a positive integer"}, 400
+    try:
+        tags = _strings([tags] if isinstance(tags, str) else tags)
+    except ValueError as e:
+        log(f"==== Error: {e} ====")
+        return {"error": "tags must be a list of strings"}, 400
+    total, counts = tag_facets.counts(tags=Image.normalize_tags(tags), limit=limit)
+    return {"total": total, "facets": counts}
+
+
+@image_endpoint.route("/page", methods=("GET", "POST"))
+def page():
+    """
+    One page of the image gallery as an htmx fragment; the last element
+    loads the next page when revealed. The next cursor is also sent in the
+    X-Next-Cursor header.
+    {"cursor": ..., "tags": [...], "order": "newest" | "oldest", "limit": n}
+    """
+    user, *_ = _loader()
+    if request.method == "GET":
+        request_data, tags = request.args, request.args.getlist("tags")
+    else:
+        request_data, tags = request.json, request.json.get("tags")
+    order = "oldest" if request_data.get("order") == "oldest" else "newest"
+    try:
+        tags = _strings([tags] if isinstance(tags, str) else tags)
+        limit = _limit(request_data.get("limit"), _page_limit)
+        if (cursor := request_data.get("cursor")) and not (
+            isinstance(cursor, str) and ObjectId.is_valid(cursor)
+        ):
+            raise ValueError(f"invalid cursor {cursor!r}")
+        images, next_cursor = Image.page(
+            cursor=cursor,
+            limit=limit,
+            tags=tags,
+            newest_first=order == "newest",
+        )
+    except ValueError as e:
+        log(f"==== Error: {e} ====")
+        return "<p>Invalid page</p>", 400
+    html = get_template_attribute("shared/_gallery.html", "gallery_page")(
+        user, images, next_cursor, Image.normalize_tags(tags), order
+    )
+    return html, 200, {"X-Next-Cursor": next_cursor or ""}
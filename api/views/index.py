@@ -7,9 +7,10 @@
 
 import random
 
-from flask import Blueprint, get_template_attribute
+from flask import Blueprint
 
 from autonomous import log
+from utils.fragments import fragment_cache
 
 from ._utilities import loader as _loader
 
@@ -27,7 +28,7 @@ index_endpoint = Blueprint("page", __name__)
     ),
 )
 def login():
-    return get_template_attribute("login.html", "login")()
+    return fragment_cache.render("login.html", "login", None, args=())
 
 
 @index_endpoint.route(
@@ -39,4 +40,4 @@ def login():
 )
 def home():
     user, *_ = _loader()
-    return get_template_attribute("home.html", "home")(user)
+    return fragment_cache.render("home.html", "home", user, args=(user,))
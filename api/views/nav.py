@@ -5,20 +5,27 @@
 
 """
 
+import os
+from collections import defaultdict
+
 from flask import Blueprint, get_template_attribute, request
-from jinja2 import TemplateNotFound
 
 from autonomous import log
+from utils.autocomplete import autocomplete
+from utils.fragments import fragment_cache
 
+from ._utilities import get_many
 from ._utilities import loader as _loader
 
+_search_limit = int(os.environ.get("AUTOCOMPLETE_LIMIT", 10))
+
 nav_endpoint = Blueprint("nav", __name__)
 
 
 @nav_endpoint.route("/menu", methods=("POST",))
 def menu():
     user, obj, *_ = _loader()
-    return get_template_attribute("shared/_nav.html", "topnav")(user, obj)
+    return fragment_cache.render("shared/_nav.html", "topnav", user, obj)
 
 
 @nav_endpoint.route(
@@ -30,13 +37,8 @@ def menu():
 )
 def sidemenudetail(model, pk):
     user, obj, *_ = _loader(model=model, pk=pk)
-    try:
-        template = get_template_attribute(f"models/_{model}.html", "menu")
-    except (TemplateNotFound, AttributeError) as e:
-        # log(e, f"no detail menu for {model}")
-        return ""
-    else:
-        return template(user, obj)
+    # models without a detail menu render "", and the miss is remembered
+    return fragment_cache.render(f"models/_{model}.html", "menu", user, obj)
 
 
 @nav_endpoint.route(
@@ -44,9 +46,23 @@ def sidemenudetail(model, pk):
     methods=("POST",),
 )
 def navsearch():
-    user, obj, world, *_ = _loader()
-    query = request.json.get("query")
-    results = world.search_autocomplete(query=query) if len(query) > 2 else []
-    results = [r for r in results if r != obj]
+    user, obj = _loader()
+    query = request.json.get("query") or ""
+    results = []
+    if len(query) > 2:
+        keys = [k.split(":", 1) for k in autocomplete.search(query, k=_search_limit)]
+        pks = defaultdict(list)
+        for model, pk in keys:
+            pks[model].append(pk)
+        models = {Model.__name__.lower(): Model for Model in autocomplete.models()}
+        found = {}
+        for model, model_pks in pks.items():
+            if Model := models.get(model):
+                for pk, o in zip(model_pks, get_many(Model, model_pks)):
+                    found[(model, pk)] = o
+        results = [found.get(tuple(k)) for k in keys]
+        results = [r for r in results if r and r != obj]
     # log(macro, query, [r.name for r in results])
-    return get_template_attribute("_nav.html", "nav_dropdown")(user, obj, results)
+    return get_template_attribute("shared/_nav.html", "nav_dropdown")(
+        user, obj, results
+    )
@@ -16,6 +16,7 @@ Functions:
 
 Routes:
     - /favicon.ico: Endpoint to serve the favicon.
+    - /image/<pk>/<size>: Endpoint to serve images and their renditions.
 
 Blueprints:
     - The blueprints are registered with the app object, each with its respective
@@ -37,12 +38,17 @@ import os
 from config import Config
 from flask import Flask, json, render_template, request, url_for
 from views.auth import auth_page
+from views.image import image_page
 from views.index import index_page
 from werkzeug.exceptions import HTTPException
 
 from autonomous import log
 from autonomous.auth import AutoAuth
 from models.user import User
+from utils import metrics
+
+# imported for their save hooks, so saves here update the api
+from utils import autocomplete, fragments  # noqa: F401
 
 
 def create_app():
@@ -83,6 +89,9 @@ def create_app():
 
     # Register Blueprints
     app.register_blueprint(auth_page, url_prefix="/auth")
+    app.register_blueprint(image_page)
     app.register_blueprint(index_page)
 
+    # the only service exposed outside the internal network
+    metrics.install(app, public=True)
     return app
@@ -14,6 +14,17 @@ class Config:
     DEBUG = os.environ.get("DEBUG", False)
     TESTING = os.environ.get("TESTING", False)
     TRAP_HTTP_EXCEPTIONS = os.environ.get("TRAP_HTTP_EXCEPTIONS", False)
+    API_URL = os.environ.get("API_URL", f"http://api:{os.environ.get('COMM_PORT')}")
+    TASKS_URL = os.environ.get(
+        "TASKS_URL", f"http://tasks:{os.environ.get('COMM_PORT')}"
+    )
+    PROXY_TIMEOUT = float(os.environ.get("PROXY_TIMEOUT", 120))
+    PROXY_CONNECT_TIMEOUT = float(os.environ.get("PROXY_CONNECT_TIMEOUT", 5))
+    PROXY_MAX_CONNECTIONS = int(os.environ.get("PROXY_MAX_CONNECTIONS", 100))
+    PROXY_MAX_KEEPALIVE = int(os.environ.get("PROXY_MAX_KEEPALIVE", 20))
+    IMAGE_MAX_AGE = int(os.environ.get("IMAGE_MAX_AGE", 31536000))
+    SESSION_USER_TTL = float(os.environ.get("SESSION_USER_TTL", 60))
+    LAST_LOGIN_INTERVAL = float(os.environ.get("LAST_LOGIN_INTERVAL", 3600))
 
 
 class APIConfig(Config):
@@ -0,0 +1,137 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from flask import Response, current_app, stream_with_context
+
+from autonomous import log
+from utils import metrics
+
+# headers that describe a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+class Upstream:
+    """
+    A backend service reached through a shared keep-alive connection pool.
+
+    The client is created lazily so each gunicorn worker builds its own pool
+    after fork.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        name=None,
+        timeout=120.0,
+        connect_timeout=5.0,
+        max_connections=100,
+        max_keepalive=20,
+    ):
+        self.base_url = base_url
+        self.name = name or base_url
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        )
+        self.origin = httpx.URL(base_url).copy_with(path="/", query=None)
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if not self._client:
+            with self._lock:
+                if not self._client:
+                    self._client = httpx.Client(
+                        base_url=self.base_url,
+                        timeout=self.timeout,
+                        limits=self.limits,
+                    )
+        return self._client
+
+    def forward(self, method, path, params=None, json=None):
+        """
+        Sends the request upstream and streams the raw response body back
+        """
+        # paths come from the client; an absolute url would replace base_url
+        parts = urlsplit(path)
+        if parts.scheme or parts.netloc:
+            log(f"==== Error: refused to proxy {path!r} ====")
+            return Response("<p>Bad request</p>", status=400)
+        request = self.client.build_request(
+            method, "/" + path.lstrip("/"), params=params, json=json
+        )
+        if request.url.copy_with(path="/", query=None) != self.origin:
+            log(f"==== Error: refused to proxy {path!r} to {request.url} ====")
+            return Response("<p>Bad request</p>", status=400)
+        start = time.perf_counter()
+        try:
+            upstream = self.client.send(request, stream=True)
+        except httpx.TransportError as e:
+            metrics.observe_upstream(
+                self.name, method, "error", time.perf_counter() - start
+            )
+            log(f"==== Error: {self.base_url} unreachable: {e} ====")
+            return Response("<p>Service unavailable</p>", status=502)
+        metrics.observe_upstream(
+            self.name, method, upstream.status_code, time.perf_counter() - start
+        )
+
+        def body():
+            try:
+                yield from upstream.iter_raw()
+            finally:
+                upstream.close()
+
+        return Response(
+            stream_with_context(body()),
+            status=upstream.status_code,
+            headers=_passthrough_headers(upstream.headers),
+        )
+
+
+def _passthrough_headers(headers, exclude=()):
+    return [
+        (k, v)
+        for k, v in headers.items()
+        if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in exclude
+    ]
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(name):
+    """
+    Returns the shared Upstream for `name`, configured from <NAME>_URL and the
+    PROXY_* settings of the current app
+    """
+    if name not in _upstreams:
+        config = current_app.config
+        with _upstreams_lock:
+            _upstreams.setdefault(
+                name,
+                Upstream(
+                    config[f"{name.upper()}_URL"],
+                    name=name,
+                    timeout=config["PROXY_TIMEOUT"],
+                    connect_timeout=config["PROXY_CONNECT_TIMEOUT"],
+                    max_connections=config["PROXY_MAX_CONNECTIONS"],
+                    max_keepalive=config["PROXY_MAX_KEEPALIVE"],
+                ),
+            )
+    return _upstreams[name]
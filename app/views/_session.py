@@ -0,0 +1,213 @@
+import json
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import (
+    current_app,
+    g,
+    has_request_context,
+    redirect,
+    session,
+    url_for,
+)
+
+from autonomous import log
+from models.user import User
+
+# fields kept in the (signed) session cookie; anything else loads the User
+_session_fields = ("pk", "name", "role", "state", "version")
+
+
+class SessionUser:
+    """
+    The current user as stored in the session. Guest, role and state checks
+    are answered from the session payload; reading any other attribute loads
+    the full User document once and delegates to it.
+    """
+
+    def __init__(self, pk, name="", role="guest", state="guest", version=0, **kwargs):
+        self.pk = pk
+        self.name = name
+        self.role = role
+        self.state = state
+        self.version = version
+        self._user = None
+
+    def __eq__(self, other):
+        return other is not None and str(self.pk) == str(other.pk)
+
+    def __hash__(self):
+        return hash(str(self.pk))
+
+    def __repr__(self):
+        return f"<SessionUser {self.pk} {self.role}>"
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "_user":
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            pk=str(user.pk),
+            name=user.name,
+            role=user.role,
+            state=user.state,
+            version=_version(user),
+        )
+
+    @classmethod
+    def from_session(cls, payload):
+        if isinstance(payload, str):
+            # sessions created before the payload was trimmed hold User.to_json()
+            try:
+                data = json.loads(payload)
+                payload = {
+                    "pk": data["_id"]["$oid"],
+                    "name": data.get("name", ""),
+                    "role": data.get("role", "guest"),
+                    "state": data.get("state", "unauthenticated"),
+                }
+            except (ValueError, KeyError, TypeError) as e:
+                log(f"==== Error: unreadable session user: {e} ====")
+                return None
+        return cls(**payload) if payload and payload.get("pk") else None
+
+    def to_session(self):
+        return {field: getattr(self, field) for field in _session_fields} | {
+            "checked": time.time()
+        }
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.get(self.pk) or User.get_guest()
+            # the document changed since the payload was written; refresh it
+            if _version(self._user) > self.version and has_request_context():
+                self.name, self.role, self.state = (
+                    self._user.name,
+                    self._user.role,
+                    self._user.state,
+                )
+                self.version = _version(self._user)
+                if (session.get("user") or {}).get("pk") == self.pk:
+                    session["user"] = self.to_session()
+        return self._user
+
+    @property
+    def is_authenticated(self):
+        return self.state == "authenticated"
+
+    @property
+    def is_guest(self):
+        return not self.is_authenticated or self.role == "guest"
+
+    @property
+    def is_admin(self):
+        return self.is_authenticated and self.role == "admin"
+
+
+def _version(user):
+    return user.revision or 0
+
+
+def _guest():
+    """
+    The shared guest user, looked up once per process
+    """
+    app = current_app._get_current_object()
+    if not (guest := app.extensions.get("guest_user")):
+        guest = app.extensions["guest_user"] = SessionUser.from_user(User.get_guest())
+    return guest
+
+
+def _revalidate(user):
+    """
+    Re-reads role and state with a projected query, so a role change or a
+    logout elsewhere reaches this session within SESSION_USER_TTL seconds
+    """
+    doc = (
+        User.objects(pk=user.pk)
+        .only("name", "role", "state", "revision")
+        .as_pymongo()
+        .first()
+    )
+    if not doc:
+        return None
+    user.name = doc.get("name", user.name)
+    user.role = doc.get("role", user.role)
+    user.state = doc.get("state", user.state)
+    user.version = doc.get("revision", 0)
+    return user
+
+
+def login(user):
+    """
+    Stores `user` as the session user
+    """
+    g.current_user = SessionUser.from_user(user)
+    g.current_user._user = user
+    session["user"] = g.current_user.to_session()
+    session["last_login"] = time.time()
+    return g.current_user
+
+
+def logout():
+    if user := current_user():
+        if user.is_authenticated:
+            user = user.user
+            user.state = "unauthenticated"
+            user.save()
+    session.pop("user", None)
+    g.pop("current_user", None)
+
+
+def current_user():
+    """
+    Resolves the session user once per request. Authenticated users are
+    re-checked against the db every SESSION_USER_TTL seconds; everyone else
+    is the guest user.
+    """
+    if "current_user" in g:
+        return g.current_user
+    payload = session.get("user")
+    user = SessionUser.from_session(payload)
+    if user and user.is_authenticated:
+        checked = payload.get("checked", 0) if isinstance(payload, dict) else 0
+        if time.time() - checked > current_app.config["SESSION_USER_TTL"]:
+            user = _revalidate(user)
+            if user:
+                session["user"] = user.to_session()
+    if not user or not user.is_authenticated:
+        user = _guest()
+    g.current_user = user
+    return user
+
+
+def auth_required(guest=False, admin=False):
+    """
+    Session based replacement for AutoAuth.auth_required. last_login is
+    written at most once per LAST_LOGIN_INTERVAL instead of saving the user
+    on every request.
+    """
+
+    def wrap(func):
+        @wraps(func)
+        def decorated_view(*args, **kwargs):
+            user = current_user()
+            if user.is_authenticated:
+                last_login = session.get("last_login", 0)
+                if time.time() - last_login > current_app.config["LAST_LOGIN_INTERVAL"]:
+                    User.objects(pk=user.pk).update_one(set__last_login=datetime.now())
+                    session["last_login"] = time.time()
+            if not guest and user.is_guest:
+                return redirect(url_for("auth.login"))
+            if admin and not user.is_admin:
+                return redirect(url_for("auth.login"))
+            return func(*args, **kwargs)
+
+        return decorated_view
+
+    return wrap
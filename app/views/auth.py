@@ -8,22 +8,24 @@ from datetime import datetime
 from flask import Blueprint, redirect, render_template, request, session, url_for
 
 from autonomous import log
-from autonomous.auth import AutoAuth, GoogleAuth
+from autonomous.auth import GoogleAuth
 from models.user import User
 
+from . import _session
+
 auth_page = Blueprint("auth", __name__)
 
 
 @auth_page.route("/login", methods=("GET", "POST"))
 def login():
-    # log(AutoAuth.current_user().to_json())
-    user = AutoAuth.current_user()
-    if user.role != "guest":
+    # log(_session.current_user())
+    user = _session.current_user()
+    if user.role != "guest" and user.state == "authenticated":
         if user.last_login:
             # f"last login: {user.last_login}")
             diff = datetime.now() - user.last_login
-            if diff.days <= 30 and AutoAuth.current_user().state == "authenticated":
-                # log(f"successfully logged in {AutoAuth.current_user().email}")
+            if diff.days <= 30:
+                # log(f"successfully logged in {user.email}")
                 return redirect("/home")
 
     if request.method == "POST":
@@ -46,7 +48,7 @@ def authorize():
     )
     # log(user_info)
     if user := User.authenticate(user_info, token):
-        session["user"] = user.to_json()
+        _session.login(user)
     else:
         session["user"] = None
     # log(session["user"])
@@ -57,12 +59,10 @@ def authorize():
 def logout():
     if session.get("user"):
         try:
-            user = User.from_json(session["user"])
-            user.state = "unauthenticated"
-            # log(f"User {user} logged out")
-            user.save()
+            # log(f"User {_session.current_user()} logged out")
+            _session.logout()
         except Exception as e:
             log(e)
-        session.pop("user")
+        session.pop("user", None)
 
     return redirect(url_for("auth.login"))
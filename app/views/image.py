@@ -0,0 +1,49 @@
+from bson import ObjectId
+from flask import Blueprint, Response, current_app, request
+
+from models.image import Image
+
+image_page = Blueprint("image", __name__)
+
+
+@image_page.route("/image/<string:pk>/<string:size>", methods=("GET", "HEAD"))
+def image(pk, size):
+    """
+    Serves an image or one of its renditions. Conditional requests are
+    answered from the document's content hash without reading the blob.
+    """
+    obj = (
+        Image.objects(pk=pk).only("data", "data_hash").first()
+        if ObjectId.is_valid(pk)
+        else None
+    )
+    if not obj or not obj.data:
+        return "", 404
+    if size != "orig":
+        try:
+            Image.rendition_size(size)
+        except ValueError:
+            return "", 404
+
+    etag = obj.etag(size)
+    if request.args.get("v") == obj.version[:16]:
+        cache_control = (
+            f"public, max-age={current_app.config['IMAGE_MAX_AGE']}, immutable"
+        )
+    else:
+        cache_control = "public, no-cache"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        return response
+
+    data = obj.read() if size == "orig" else obj.resize(size)
+    if not data:
+        return "", 404
+    response = Response(data, mimetype="image/webp")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=len(data)
+    )
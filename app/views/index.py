@@ -1,6 +1,3 @@
-import os
-
-import requests
 from flask import (
     Blueprint,
     render_template,
@@ -9,16 +6,19 @@ from flask import (
 )
 
 from autonomous import log
-from autonomous.auth import AutoAuth, auth_required
 from autonomous.model.automodel import AutoModel
 
+from utils.membership import membership
+
+from ._proxy import upstream as _upstream
+from ._session import auth_required
+from ._session import current_user as _current_user
+
 index_page = Blueprint("index", __name__)
 
 
-def _authenticate(user, obj):
-    if user in obj.get_world().users:
-        return True
-    return False
+def _authenticate(user, model, pk):
+    return membership.is_member(user, model, pk)
 
 
 # def update_with_session(requestdata):
@@ -32,7 +32,7 @@ def _authenticate(user, obj):
 @index_page.route("/home", endpoint="index", methods=("GET", "POST"))
 @auth_required()
 def index():
-    user = AutoAuth.current_user()
+    user = _current_user()
     session["page"] = "/home"
     return render_template("index.html", user=user, page_url="/home")
 
@@ -41,7 +41,7 @@ def index():
 @index_page.route("/<string:model>/<string:pk>/<path:page>", methods=("GET", "POST"))
 @auth_required(guest=True)
 def page(model, pk, page=""):
-    user = AutoAuth.current_user()
+    user = _current_user()
     session["page"] = f"/{model}/{pk}/{page or 'details'}"
     if obj := AutoModel.get_model(model, pk):
         session["model"] = model
@@ -59,27 +59,25 @@ def page(model, pk, page=""):
 )
 # @auth_required(guest=True)
 def api(rest_path):
-    url = f"http://api:{os.environ.get('COMM_PORT')}/{rest_path}"
     response = "<p>You do not have permission to alter this object<p>"
     # log(request.method)
-    user = AutoAuth.current_user()
+    user = _current_user()
     if request.method == "GET":
-        rest_path = request.path.replace("/api/", "")
         params = dict(request.args)
         params["user"] = user.pk
-        url = f"http://api:{os.environ.get('COMM_PORT')}/{rest_path}?{requests.compat.urlencode(params)}"
-        log("API GET REQUEST", url)
-        response = requests.get(url).text
+        # log("API GET REQUEST", rest_path, params)
+        response = _upstream("api").forward("GET", rest_path, params=params)
     elif not user.is_guest:
-        log("API POST REQUEST", rest_path, request.json)
-        if "admin/" in url and user.is_admin:
-            response = requests.post(url, json=request.json).text
+        # log("API POST REQUEST", rest_path, request.json)
+        # the api trusts "user", so it is always the session user
+        payload = {**request.json, "user": user.pk}
+        if "admin/" in rest_path and user.is_admin:
+            response = _upstream("api").forward("POST", rest_path, json=payload)
         elif request.json.get("model") and request.json.get("pk"):
-            obj = AutoModel.get_model(request.json.get("model"), request.json.get("pk"))
-            if _authenticate(user, obj):
-                response = requests.post(url, json=request.json).text
+            if _authenticate(user, request.json.get("model"), request.json.get("pk")):
+                response = _upstream("api").forward("POST", rest_path, json=payload)
         else:
-            response = requests.post(url, json=request.json).text
+            response = _upstream("api").forward("POST", rest_path, json=payload)
     # log(response)
     return response
 
@@ -87,12 +85,23 @@ def api(rest_path):
 @index_page.route("/task/<path:rest_path>", endpoint="tasks", methods=("POST",))
 @auth_required()
 def tasks(rest_path):
-    user = AutoAuth.current_user()
-    obj = AutoModel.get_model(request.json.get("model")).get(request.json.get("pk"))
-    if _authenticate(user, obj):
-        log(request.json)
-        response = requests.post(
-            f"http://tasks:{os.environ.get('COMM_PORT')}/{rest_path}", json=request.json
-        )
+    response = "<p>You do not have permission to alter this object<p>"
+    user = _current_user()
+    if _authenticate(user, request.json.get("model"), request.json.get("pk")):
+        # log(request.json)
+        # the tasks service records "user" as the task's owner
+        payload = {**request.json, "user": user.pk}
+        response = _upstream("tasks").forward("POST", rest_path, json=payload)
         # log(response.text)
-    return response.text
+    return response
+
+
+@index_page.route(
+    "/task/stream/<string:taskid>", endpoint="taskstream", methods=("GET",)
+)
+@auth_required()
+def taskstream(taskid):
+    # only the user who started the task is streamed its result
+    return _upstream("tasks").forward(
+        "GET", f"stream/{taskid}", params={"user": _current_user().pk}
+    )
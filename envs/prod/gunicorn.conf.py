@@ -1,9 +1,66 @@
 import multiprocessing
 import os
 
+
+def _cpu_count():
+    # the cpus this container may run on, not every cpu on the host
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def _memory_limit():
+    """
+    Memory available to the container in bytes: the cgroup limit if one is
+    set, otherwise the host's physical memory
+    """
+    for path in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+            if limit.isdigit() and int(limit) < 1 << 60:
+                return int(limit)
+        except OSError:
+            pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _workers():
+    if workers := os.environ.get("GUNICORN_WORKERS"):
+        return int(workers)
+    by_cpu = 2 * _cpu_count() + 1
+    worker_memory = int(os.environ.get("GUNICORN_WORKER_MEMORY_MB", 256)) << 20
+    by_memory = _memory_limit() // worker_memory
+    return max(1, min(by_cpu, by_memory))
+
+
 # Non logging stuff
 bind = f"{os.environ.get('APP_HOST', '0.0.0.0')}:{os.environ.get('COMM_PORT', 80)}"
-workers = 4
+workers = _workers()
+# Most request time is spent waiting on the api/tasks upstreams, GridFS and
+# SSE streams, so each worker serves several requests at once. "gevent" also
+# works if gevent is installed in the image.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+# heartbeat files on tmpfs; a disk-backed /tmp can stall workers in docker
+worker_tmp_dir = "/dev/shm"
+
+# Import the app once in the master so workers share its pages copy-on-write
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Restart workers after a number of requests to contain memory growth. The
+# jitter keeps them from all restarting at the same moment.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
 access_log_format = "ACCESS - %(U)s-%(m)s - res time: %(M)s %(b)s \n"
 error_log_format = "ERROR - %(U)s :: \n"
 # Access log - records incoming HTTP requests
@@ -11,3 +68,18 @@ accesslog = os.getenv("ACCESS_LOG", "-")
 # Error log - records Gunicorn server goings-on
 errorlog = os.getenv("ERROR_LOG", "-")
 loglevel = "error"
+
+
+def pre_fork(server, worker):
+    # the preloaded app connected to Mongo in the master; every worker must
+    # open its own client
+    if preload_app:
+        from utils.connections import release_mongo_client
+
+        release_mongo_client()
+
+
+def child_exit(server, worker):
+    from utils.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -5,6 +5,9 @@ from glob import glob
 bind = f"{os.environ.get('APP_HOST', '0.0.0.0')}:{os.environ.get('COMM_PORT', 80)}"
 timeout = 120
 workers = 2
+# threads, so a few open /stream SSE connections cannot stall the service
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
 capture_output = True  # Whether to send output to the error log
 
 access_log_format = "ACCESS - %(U)s-%(m)s - res time: %(M)s %(b)s \n"
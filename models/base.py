@@ -1,12 +1,4 @@
-import io
-import random
-
-import requests
-from bs4 import BeautifulSoup
-from PIL import Image as ImageTools
-
 from autonomous import log
-from autonomous.ai.imageagent import ImageAgent
 from autonomous.model.autoattr import (
     FileAttr,
     ListAttr,
@@ -1,12 +1,16 @@
+import hashlib
 import io
-import random
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
-import requests
-from bs4 import BeautifulSoup
+import gridfs
+import httpx
+from bson import ObjectId
 from PIL import Image as ImageTools
 
 from autonomous import log
-from autonomous.ai.imageagent import ImageAgent
+from autonomous.db import signals
 from autonomous.model.autoattr import (
     FileAttr,
     ListAttr,
@@ -14,21 +18,100 @@ from autonomous.model.autoattr import (
     StringAttr,
 )
 from autonomous.model.automodel import AutoModel
+from utils import phash, renditions
+from utils.cache import LRUCache
+from utils.facets import tag_facets
+from utils.registry import model_classes
+from utils.resilience import GuardedClient
+from utils.transforms import ImageTransform
 
 
 class Image(AutoModel):
-    # meta = {"collection": "Image"}
+    meta = {"indexes": [("tags", "-id"), "-id", "dhash_bands"]}
     data = FileAttr(default="")
+    data_hash = StringAttr(default="")
+    # perceptual hash of the data (utils/phash.py) and its indexed parts
+    dhash = StringAttr(default="")
+    dhash_bands = ListAttr(StringAttr(default=""))
     prompt = StringAttr(default="")
     tags = ListAttr(StringAttr(default=""))
     associations = ListAttr(ReferenceAttr(choices=["TTRPGBase"]))
 
     ################### Class Variables #####################
-    _client = ImageAgent()
+    # the image generation backend; created on first use, since importing it
+    # pulls in the whole openai client
+    _client = None
+    # _client behind timeouts, retries, a rate limit shared by every worker
+    # and a circuit breaker (utils/resilience.py), set by IMAGE_AGENT_*
+    _guarded_client = None
 
     _sizes = {"thumbnail": 100, "small": 300, "medium": 600, "large": 1000}
 
+    # fields loaded for image listings; skips the prompt text and associations
+    _list_fields = ("_cls", "data", "data_hash", "tags")
+    # fields loaded for paged listings (see page); url() only needs data_hash,
+    # so the FileAttr is left out and no GridFS proxy is built per image
+    _page_fields = ("_cls", "data_hash", "tags")
+    _page_size = int(os.environ.get("IMAGE_PAGE_SIZE", 48))
+
+    # fields indexed for the nav search autocomplete (utils/autocomplete.py)
+    _autocomplete_fields = ("tags",)
+
+    # renditions are stored in their own GridFS bucket, keyed by (pk, content hash, size)
+    _rendition_collection = "image_renditions"
+    _rendition_indexed = False
+    _renditions = LRUCache(maxsize=int(os.environ.get("IMAGE_CACHE_SIZE", 256)))
+
+    # max concurrent backend calls made by generate_batch
+    _batch_workers = int(os.environ.get("IMAGE_BATCH_WORKERS", 4))
+    # backend calls per minute, shared by every worker of every service
+    _agent_rate = float(os.environ.get("IMAGE_AGENT_RATE", 15))
+
+    # limits for images ingested from urls; larger dimensions are scaled down
+    _max_ingest_bytes = int(os.environ.get("IMAGE_MAX_BYTES", 20 * 1024 * 1024))
+    _max_ingest_pixels = int(os.environ.get("IMAGE_MAX_PIXELS", 50_000_000))
+    _max_ingest_dimension = int(os.environ.get("IMAGE_MAX_DIMENSION", 2048))
+    _ingest_workers = int(os.environ.get("IMAGE_INGEST_WORKERS", 8))
+    _http_client = None
+
+    # ingested images within this many bits of a stored image's perceptual
+    # hash reuse it instead; the band index only finds up to BANDS - 1 bits
+    _dedupe_distance = min(
+        int(os.environ.get("IMAGE_DEDUPE_DISTANCE", 3)), phash.BANDS - 1
+    )
+
     ################### Class Methods #####################
+    @classmethod
+    def _agent(cls):
+        if not Image._client:
+            from autonomous.ai.imageagent import ImageAgent
+
+            Image._client = ImageAgent()
+        if (
+            not Image._guarded_client
+            or Image._guarded_client.client is not Image._client
+        ):
+            Image._guarded_client = GuardedClient(
+                Image._client,
+                "image_agent",
+                rate=cls._agent_rate,
+                burst=cls._batch_workers,
+            )
+        return Image._guarded_client
+
+    @classmethod
+    def _generation_prompt(cls, prompt, text=False):
+        from bs4 import BeautifulSoup
+
+        prompt = BeautifulSoup(prompt, "html.parser").get_text()
+        temp_prompt = (
+            f"""{prompt}
+IMPORTANT: The image MUST NOT contain any TEXT.
+"""
+            if not text
+            else prompt
+        )
+        return prompt, temp_prompt
 
     @classmethod
     def generate(
@@ -38,163 +121,703 @@ class Image(AutoModel):
         img_quality="standard",
         img_size="1024x1024",
         text=False,
+        dedupe=True,
     ):
-        prompt = BeautifulSoup(prompt, "html.parser").get_text()
+        prompt, temp_prompt = cls._generation_prompt(prompt, text)
         # log(f"=== generation prompt ===\n\n{prompt}", _print=True)
-        temp_prompt = (
-            f"""{prompt}
-IMPORTANT: The image MUST NOT contain any TEXT.
-"""
-            if not text
-            else prompt
-        )
         try:
-            image = cls._client.generate(
+            image = cls._agent().generate(
                 prompt=temp_prompt,
             )
         except Exception as e:
             log(f"==== Error: Unable to create image ====\n\n{e}")
             return None
         else:
+            perceptual_hash = cls._perceptual_hash(image)
+            if dedupe and (existing := cls.find_duplicate(perceptual_hash)):
+                return existing._reuse(tags)
             image_obj = Image(
                 prompt=prompt,
                 tags=tags,
             )
-            image_obj.data.put(io.BytesIO(image), content_type="image/webp")
+            image_obj.write(image, perceptual_hash=perceptual_hash)
             image_obj.save()
         return image_obj
 
+    @classmethod
+    def generate_batch(
+        cls,
+        prompts,
+        tags=None,
+        max_workers=None,
+        progress=None,
+        text=False,
+        dedupe=True,
+    ):
+        """
+        generates one image per prompt with at most max_workers backend calls
+        in flight, then inserts all the new Image documents in one write.
+        Near duplicates of a stored image, or of an earlier image in the
+        batch, reuse that image.
+
+        prompts: strings, or {"prompt": ..., "tags": [...]} dicts
+        tags: tags added to every image in the batch
+        progress: optional callable(index, image_obj) called as each prompt
+            completes; image_obj is None if that generation failed
+
+        returns a list of Image objects (None for failures) in prompt order
+        """
+        items = [p if isinstance(p, dict) else {"prompt": p} for p in prompts]
+        results = [None] * len(items)
+        seen = phash.BKTree()
+
+        def _generate(item):
+            prompt, temp_prompt = cls._generation_prompt(item["prompt"], text)
+            return prompt, cls._agent().generate(prompt=temp_prompt)
+
+        with ThreadPoolExecutor(max_workers=max_workers or cls._batch_workers) as pool:
+            futures = {pool.submit(_generate, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    prompt, image = future.result()
+                except Exception as e:
+                    log(f"==== Error: Unable to create image {i} ====\n\n{e}")
+                else:
+                    results[i] = cls._batch_image(
+                        image,
+                        prompt,
+                        [*(tags or []), *items[i].get("tags", [])],
+                        results,
+                        seen if dedupe else None,
+                        i,
+                    )
+                if progress:
+                    progress(i, results[i])
+        return cls._insert_batch(results)
+
     @classmethod
     def get_image_list(cls, max=10, tags=None):
-        image_list = cls.all()
-        if tags:
-            image_list = [i for i in image_list if all(tag in i.tags for tag in tags)]
-        if image_list:
-            image_list = random.sample(image_list, k=min(len(image_list), max))
+        pipeline = []
+        if tags := cls.normalize_tags(tags):
+            pipeline.append({"$match": {"tags": {"$all": tags}}})
+        pipeline += [
+            {"$sample": {"size": max}},
+            {"$project": {field: 1 for field in cls._list_fields}},
+        ]
+        image_list = [cls._from_son(doc) for doc in cls.objects.aggregate(pipeline)]
         # [log(i) for i in image_list]
         return image_list
 
     @classmethod
-    def from_url(cls, url, prompt="", tags=None):
+    def page(cls, cursor=None, limit=None, tags=None, newest_first=True):
+        """
+        keyset pagination in creation order (by pk): returns (images, next
+        cursor) for the images after `cursor`, which is the pk of the last
+        image of the previous page. The next cursor is None on the last page.
+        Unlike skip/limit, every page costs the same however deep it is.
+
+        raises ValueError for a cursor that is not a pk
+        """
+        limit = limit or cls._page_size
+        filters = {}
+        if tags := cls.normalize_tags(tags):
+            filters["tags__all"] = tags
+        if cursor:
+            if not ObjectId.is_valid(str(cursor)):
+                raise ValueError(f"Invalid page cursor: {cursor}")
+            filters["pk__lt" if newest_first else "pk__gt"] = ObjectId(str(cursor))
+        # the queryset's query includes _cls, which prefixes every index
+        query = cls.objects(**filters)._query
+        # one extra document tells whether there is a next page
+        docs = list(
+            cls._get_collection()
+            .find(query, {field: 1 for field in cls._page_fields})
+            .sort("_id", -1 if newest_first else 1)
+            .limit(limit + 1)
+        )
+        images = [cls._from_son(doc) for doc in docs[:limit]]
+        return images, str(images[-1].pk) if len(docs) > limit else None
+
+    @classmethod
+    def normalize_tags(cls, tags):
+        """
+        stripped and lowercased, without blanks or repeats, in first-seen order
+        """
+        return list(
+            dict.fromkeys(t.strip().lower() for t in tags or [] if t and t.strip())
+        )
+
+    @classmethod
+    def retag(cls, pks, add=None, remove=None):
+        """
+        adds and removes tags on every image in pks with one atomic update
+        each ($addToSet, then $pull; one update cannot do both to a field).
+        Only images that change are written. A tag in both lists is added.
+
+        The save hooks do not run, so post_save is sent for every changed
+        image, loaded with just its tags, to keep the caches listening to it
+        current.
+
+        returns the number of images changed
+        """
+        add = cls.normalize_tags(add)
+        remove = [t for t in cls.normalize_tags(remove) if t not in add]
+        ids = [ObjectId(str(pk)) for pk in pks or [] if ObjectId.is_valid(str(pk))]
+        updates = []
+        if add:
+            updates.append(
+                (
+                    {"tags": {"$not": {"$all": add}}},
+                    {"$addToSet": {"tags": {"$each": add}}},
+                )
+            )
+        if remove:
+            updates.append(
+                ({"tags": {"$in": remove}}, {"$pull": {"tags": {"$in": remove}}})
+            )
+        collection, changed = cls._get_collection(), set()
+        for match, update in updates if ids else []:
+            targets = {
+                doc["_id"]: set(doc.get("tags", []))
+                for doc in collection.find({"_id": {"$in": ids}, **match}, {"tags": 1})
+            }
+            if targets:
+                collection.update_many(
+                    {"_id": {"$in": list(targets)}},
+                    {**update, "$set": {"last_updated": datetime.now()}},
+                )
+                changed.update(targets)
+                if "$pull" in update:
+                    tag_facets.apply(
+                        removed=[t for c in targets.values() for t in c if t in remove]
+                    )
+                else:
+                    tag_facets.apply(
+                        added=[t for c in targets.values() for t in add if t not in c]
+                    )
+        for image in cls.objects(pk__in=list(changed)).only("tags"):
+            signals.post_save.send(cls, document=image, created=False)
+        return len(changed)
+
+    @classmethod
+    def from_url(cls, url, prompt="", tags=None, dedupe=True):
         tags = tags if tags else []
         try:
-            response = requests.get(url)
+            image = cls._ingest(cls._fetch(url))
+        except (
+            httpx.HTTPError,
+            ValueError,
+            IOError,
+            ImageTools.DecompressionBombError,
+        ) as e:
+            log(f"==== Error: {e} ====")
+            return None
+        perceptual_hash = cls._perceptual_hash(image)
+        if dedupe and (existing := cls.find_duplicate(perceptual_hash)):
+            return existing._reuse(tags)
+        image_obj = Image(
+            prompt=prompt,
+            tags=tags,
+        )
+        image_obj.write(image, perceptual_hash=perceptual_hash)
+        image_obj.save()
+        return image_obj
+
+    @classmethod
+    def from_urls(cls, urls, prompt="", tags=None, max_workers=None, dedupe=True):
+        """
+        ingests many urls concurrently through the shared connection pool,
+        then inserts all the new Image documents in one write. Near
+        duplicates reuse the stored image, as in generate_batch.
+
+        urls: strings, or {"url": ..., "prompt": ..., "tags": [...]} dicts
+
+        returns a list of Image objects (None for failures) in url order
+        """
+        items = [u if isinstance(u, dict) else {"url": u} for u in urls]
+        results = [None] * len(items)
+        seen = phash.BKTree()
+
+        def _ingest_url(item):
+            return cls._ingest(cls._fetch(item["url"]))
+
+        with ThreadPoolExecutor(max_workers=max_workers or cls._ingest_workers) as pool:
+            futures = {
+                pool.submit(_ingest_url, item): i for i, item in enumerate(items)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    image = future.result()
+                except (
+                    httpx.HTTPError,
+                    ValueError,
+                    IOError,
+                    ImageTools.DecompressionBombError,
+                ) as e:
+                    log(f"==== Error: {items[i]['url']}: {e} ====")
+                else:
+                    results[i] = cls._batch_image(
+                        image,
+                        items[i].get("prompt", prompt),
+                        [*(tags or []), *items[i].get("tags", [])],
+                        results,
+                        seen if dedupe else None,
+                        i,
+                    )
+        return cls._insert_batch(results)
+
+    @classmethod
+    def _batch_image(cls, image, prompt, tags, results, seen, index):
+        """
+        the Image for one result of a batch: an earlier result or a stored
+        image if it is a near duplicate of either, otherwise a new, unsaved one.
+        `seen` indexes the batch's perceptual hashes; None disables dedupe.
+        """
+        perceptual_hash = cls._perceptual_hash(image)
+        if seen is not None and phash.comparable(perceptual_hash):
+            if match := seen.search(perceptual_hash, cls._dedupe_distance):
+                return results[match[0][1]]._reuse(tags)
+            if existing := cls.find_duplicate(perceptual_hash):
+                return existing._reuse(tags)
+            seen.add(perceptual_hash, index)
+        image_obj = Image(prompt=prompt, tags=tags)
+        image_obj.write(image, perceptual_hash=perceptual_hash)
+        # bulk inserts skip the save hooks
+        image_obj.pre_save_tags()
+        return image_obj
+
+    @classmethod
+    def _insert_batch(cls, results):
+        """
+        inserts the unsaved images of a batch in one write and puts the saved
+        documents in their place; an image may fill more than one result
+        """
+        if new := list({id(r): r for r in results if r and not r.pk}.values()):
+            inserted = dict(zip(map(id, new), cls.objects.insert(new)))
+            results = [inserted.get(id(r), r) for r in results]
+            tag_facets.apply(added=[t for r in new for t in r.tags])
+            renditions.enqueue(inserted.values())
+        return results
+
+    @classmethod
+    def _http(cls):
+        if not Image._http_client:
+            Image._http_client = httpx.Client(
+                timeout=float(os.environ.get("IMAGE_FETCH_TIMEOUT", 30)),
+                limits=httpx.Limits(max_connections=cls._ingest_workers * 2),
+                follow_redirects=True,
+            )
+        return Image._http_client
+
+    @classmethod
+    def _fetch(cls, url):
+        """
+        streams an image url into memory, refusing anything that is not an
+        image or is larger than _max_ingest_bytes
+        """
+        buffer = io.BytesIO()
+        with cls._http().stream("GET", url) as response:
             response.raise_for_status()
-            if not response.headers["Content-Type"].startswith("image/"):
+            if not response.headers.get("Content-Type", "").startswith("image/"):
                 raise ValueError("URL does not point to a valid image.")
-            with ImageTools.open(io.BytesIO(response.content)) as img:
-                width, height = img.size
-                if width != height:
-                    max_size = min(width, height)
-                    img = img.crop(
-                        (
-                            (width - max_size) / 2,
-                            (height - max_size) / 2,
-                            (width + max_size) / 2,
-                            (height + max_size) / 2,
-                        )
+            if int(response.headers.get("Content-Length") or 0) > cls._max_ingest_bytes:
+                raise ValueError(f"Image at {url} is larger than the ingest limit.")
+            for chunk in response.iter_bytes():
+                if buffer.tell() + len(chunk) > cls._max_ingest_bytes:
+                    raise ValueError(f"Image at {url} is larger than the ingest limit.")
+                buffer.write(chunk)
+        buffer.seek(0)
+        return buffer
+
+    @classmethod
+    def _ingest(cls, stream):
+        """
+        center crops an image stream to a square no larger than
+        _max_ingest_dimension and returns it encoded as WEBP
+        """
+        with ImageTools.open(stream) as img:
+            # only the header has been read at this point
+            if img.width * img.height > cls._max_ingest_pixels:
+                raise ValueError("Image has too many pixels to ingest.")
+            max_dimension = cls._max_ingest_dimension
+            # JPEGs can be decoded at a reduced scale; other formats ignore draft()
+            img.draft("RGB", (max_dimension, max_dimension))
+            width, height = img.size
+            if width != height:
+                max_size = min(width, height)
+                img = img.crop(
+                    (
+                        (width - max_size) // 2,
+                        (height - max_size) // 2,
+                        (width + max_size) // 2,
+                        (height + max_size) // 2,
                     )
-                img = img.copy()
+                )
+            if max(img.size) > max_dimension:
+                img.thumbnail((max_dimension, max_dimension))
+            img_byte_arr = io.BytesIO()
+            img.save(img_byte_arr, format="WEBP")
+        return img_byte_arr.getvalue()
+
+    @classmethod
+    def _rendition_fs(cls):
+        fs = gridfs.GridFS(cls._get_db(), collection=cls._rendition_collection)
+        if not cls._rendition_indexed:
+            cls._get_db()[f"{cls._rendition_collection}.files"].create_index("image")
+            cls._rendition_indexed = True
+        return fs
+
+    @classmethod
+    def render_renditions(cls, raw_data):
+        """
+        decodes raw_data (any bytes-like object) once and returns
+        {size: WEBP bytes} for every size in _sizes
+        """
+        rendered = {}
+        with ImageTools.open(io.BytesIO(raw_data)) as img:
+            # largest first, so each thumbnail pass starts from the previous reduction
+            for size in sorted(cls._sizes.values(), reverse=True):
+                img.thumbnail((size, size))
                 img_byte_arr = io.BytesIO()
                 img.save(img_byte_arr, format="WEBP")
-                image_obj = Image(
-                    prompt=prompt,
-                    tags=tags,
+                rendered[size] = img_byte_arr.getvalue()
+        return rendered
+
+    @classmethod
+    def _perceptual_hash(cls, raw_data):
+        try:
+            return phash.dhash_bytes(raw_data)
+        except (OSError, ValueError, ImageTools.DecompressionBombError):
+            return None
+
+    @classmethod
+    def find_duplicate(cls, perceptual_hash, distance=None):
+        """
+        returns the stored image nearest to `perceptual_hash` (an int, see
+        utils/phash.py) if it is within `distance` bits, else None. Only
+        images sharing one of the hash's bands are compared, and flat images
+        (see phash.comparable) match nothing.
+        """
+        if not phash.comparable(perceptual_hash):
+            return None
+        distance = cls._dedupe_distance if distance is None else distance
+        nearest = None
+        # the queryset's query includes _cls, which prefixes every index
+        query = cls.objects(dhash_bands__in=phash.bands(perceptual_hash))._query
+        for doc in cls._get_collection().find(query, {"dhash": 1}):
+            d = phash.hamming(perceptual_hash, phash.from_hex(doc["dhash"]))
+            if d <= distance and (not nearest or d < nearest[0]):
+                nearest = (d, doc["_id"])
+        return cls.get(nearest[1]) if nearest else None
+
+    @classmethod
+    def dedupe(cls, distance=None, dry_run=False, batch_size=100):
+        """
+        hashes the images stored without a perceptual hash, then folds every
+        near duplicate into the oldest image it matches: tags, associations
+        and references from other models move to that image and the
+        duplicate is deleted. dry_run still hashes, but only counts duplicates.
+
+        returns {"hashed": n, "groups": n, "duplicates": n, "removed": n}
+        """
+        distance = cls._dedupe_distance if distance is None else distance
+        collection = cls._get_collection()
+        missing = [
+            doc["_id"]
+            for doc in collection.find({"dhash": {"$in": ["", None]}}, {"_id": 1})
+        ]
+        hashed = 0
+        for start in range(0, len(missing), batch_size):
+            for image in cls.objects(pk__in=missing[start : start + batch_size]).only(
+                "data"
+            ):
+                perceptual_hash = cls._perceptual_hash(image.read() or b"")
+                if perceptual_hash is None:
+                    continue
+                # a direct update, so no save hooks; last_updated is set so
+                # incremental backups (utils/backup.py) carry the new hash
+                collection.update_one(
+                    {"_id": image.pk},
+                    {
+                        "$set": {
+                            "dhash": phash.to_hex(perceptual_hash),
+                            "dhash_bands": phash.bands(perceptual_hash),
+                            "last_updated": datetime.now(),
+                        }
+                    },
                 )
-                image_obj.data.put(img_byte_arr.getvalue(), content_type="image/webp")
-                image_obj.save()
-                return image_obj
-        except (requests.exceptions.RequestException, ValueError, IOError) as e:
-            log(f"==== Error: {e} ====")
-        return None
+                hashed += 1
+
+        # oldest first, so each group is kept under its original image
+        tree, duplicates = phash.BKTree(), {}
+        for doc in collection.find({"dhash": {"$nin": ["", None]}}, {"dhash": 1}).sort(
+            "_id", 1
+        ):
+            perceptual_hash = phash.from_hex(doc["dhash"])
+            if not phash.comparable(perceptual_hash):
+                continue
+            if match := tree.search(perceptual_hash, distance):
+                duplicates.setdefault(match[0][1], []).append(doc["_id"])
+            else:
+                tree.add(perceptual_hash, doc["_id"])
+
+        removed = 0
+        if not dry_run:
+            for pk, duplicate_pks in duplicates.items():
+                if keeper := cls.get(pk):
+                    for duplicate in cls.objects(pk__in=duplicate_pks):
+                        keeper._absorb(duplicate)
+                        removed += 1
+        result = {
+            "hashed": hashed,
+            "groups": len(duplicates),
+            "duplicates": sum(map(len, duplicates.values())),
+            "removed": removed,
+        }
+        log(f"=== Image dedupe: {result} ===")
+        return result
 
     ################### Dunder Methods #####################
     ################### Property Methods #####################
+    @property
+    def version(self):
+        """
+        identifies the current image data; changes whenever the data is rewritten
+        """
+        return self.data_hash or str(self.data.grid_id or "")
+
     ################### Crud Methods #####################
     def read(self):
         if self.data:
             self.data.seek(0)
             return self.data.read()
 
+    def write(self, raw_data, content_type="image/webp", perceptual_hash=None):
+        """
+        stores raw_data as the image data. When replacing existing data, the
+        new file is written and the document saved before the old file is
+        dropped, so the document never points at a missing file.
+        perceptual_hash skips hashing data the caller has already hashed.
+        """
+        old_grid_id = self.data.grid_id
+        self.data.grid_id = None
+        self.data.gridout = None
+        self.data.put(raw_data, content_type=content_type)
+        self.data_hash = hashlib.sha256(raw_data).hexdigest()
+        if perceptual_hash is None:
+            perceptual_hash = self._perceptual_hash(raw_data)
+        if perceptual_hash is None:
+            self.dhash, self.dhash_bands = "", []
+        else:
+            self.dhash = phash.to_hex(perceptual_hash)
+            # flat images are never looked up, so keep them out of the index
+            self.dhash_bands = (
+                phash.bands(perceptual_hash)
+                if phash.comparable(perceptual_hash)
+                else []
+            )
+        if old_grid_id:
+            self.save()
+            self.data.fs.delete(old_grid_id)
+
     def delete(self):
+        self.clear_renditions()
         if self.data:
             self.data.delete()
-        return super().delete()
+        stored = self._stored_tags()
+        result = super().delete()
+        tag_facets.apply(removed=stored)
+        return result
 
     ################### Instance Methods #####################
 
     def url(self, size="orig"):
+        """
+        versioned url; the v parameter changes whenever the data is rewritten,
+        so responses for it can be cached indefinitely
+        """
+        if version := self.version:
+            return f"/image/{self.pk}/{size}?v={version[:16]}"
         return f"/image/{self.pk}/{size}"
 
+    def etag(self, size="orig"):
+        return f"{self.version}-{size}"
+
     def add_tag(self, tag):
-        if tag not in self.tags:
-            self.tags.append(tag)
-            self.save()
+        self.add_tags([tag])
 
     def add_tags(self, tags):
-        for tag in tags:
-            self.add_tag(tag)
+        """
+        one atomic update for all of tags (see retag); unsaved images only
+        change in memory
+        """
+        if new := [t for t in self.normalize_tags(tags) if t not in self.tags]:
+            if self.pk:
+                Image.retag([self.pk], add=new)
+            self.tags = [*self.tags, *new]
 
     def remove_tag(self, tag):
-        try:
-            self.tags.remove(tag)
+        self.remove_tags([tag])
+
+    def remove_tags(self, tags):
+        if (tags := set(self.normalize_tags(tags))) & set(self.tags):
+            if self.pk:
+                Image.retag([self.pk], remove=tags)
+            self.tags = [t for t in self.tags if t not in tags]
+
+    def _reuse(self, tags):
+        """
+        adds the tags an ingest asked for when it returns this image instead
+        of a new one
+        """
+        self.add_tags(tags)
+        return self
+
+    def _absorb(self, duplicate):
+        """
+        takes over a near duplicate's tags, associations and every reference
+        to it from other models, then deletes it
+        """
+        self._reuse(duplicate.tags)
+        if new := [a for a in duplicate.associations if a not in self.associations]:
+            self.associations = [*self.associations, *new]
             self.save()
-        except ValueError:
-            pass
+        for model in model_classes():
+            if issubclass(model, Image):
+                continue
+            for name, field in model._fields.items():
+                if isinstance(field, ListAttr) and isinstance(
+                    field.field, ReferenceAttr
+                ):
+                    for obj in model.objects(**{name: duplicate}):
+                        setattr(
+                            obj,
+                            name,
+                            [self if r == duplicate else r for r in getattr(obj, name)],
+                        )
+                        obj.save()
+                elif isinstance(field, ReferenceAttr):
+                    for obj in model.objects(**{name: duplicate}):
+                        setattr(obj, name, self)
+                        obj.save()
+        duplicate.delete()
 
-    def resize(self, max_size=1024):
+    @classmethod
+    def rendition_size(cls, size):
         """
-        returns a dynamically resized image file
+        the pixel size for a name in _sizes or one of its values; anything
+        else raises ValueError, so requests cannot ask for arbitrary sizes
         """
-        if raw_data := self.read():
-            img = ImageTools.open(io.BytesIO(raw_data))
-            resized_img = img.copy()
-            max_size = self._sizes.get(max_size) or int(max_size)
-            if max_size <= 0:
-                raise ValueError("Invalid max_size value. Must be a positive integer.")
-            resized_img.thumbnail((max_size, max_size))
-            img_byte_arr = io.BytesIO()
-            resized_img.save(img_byte_arr, format="WEBP")
-            return img_byte_arr.getvalue()
+        if size in cls._sizes:
+            return cls._sizes[size]
+        if str(size).isdigit() and int(size) in cls._sizes.values():
+            return int(size)
+        raise ValueError(f"Invalid size {size!r}. Must be one of {list(cls._sizes)}.")
 
-    def rotate(self, amount=-90):
+    def resize(self, max_size="large"):
+        """
+        returns one of the _sizes renditions, served from the rendition cache
+        when possible
+        """
+        max_size = self.rendition_size(max_size)
+        if not self.data:
+            return None
+        key = (str(self.pk), self.version, max_size)
+        if rendition := Image._renditions.get(key):
+            return rendition
+        rendition = self.load_rendition(max_size)
+        if not rendition:
+            rendition = self.build_renditions().get(max_size)
+        if rendition:
+            Image._renditions.set(key, rendition)
+        return rendition
+
+    def rendition_name(self, size):
+        return f"{self.pk}/{self.version}/{size}"
+
+    def load_rendition(self, size):
+        if grid_out := self._rendition_fs().find_one(
+            {"filename": self.rendition_name(size)}
+        ):
+            return grid_out.read()
+
+    def build_renditions(self):
+        """
+        decodes the image once and stores every size in _sizes alongside the
+        original. utils/renditions.py does the same for many images at once.
+        """
+        rendered = {}
         if raw_data := self.read():
-            # Open the image
-            rotated_img = ImageTools.open(io.BytesIO(raw_data))
-            # Rotate the image
-            rotated_img = rotated_img.rotate(amount, expand=True)
-            rotated_img_byte_arr = io.BytesIO()
-            rotated_img.save(rotated_img_byte_arr, format="WEBP")
-            rotated_img_data = rotated_img_byte_arr.getvalue()
-            self.data.delete()
-            self.data.put(rotated_img_data, content_type="image/webp")
+            rendered = self.render_renditions(raw_data)
+            fs = self._rendition_fs()
+            for grid_out in fs.find(
+                {"image": str(self.pk), "version": {"$ne": self.version}}
+            ):
+                fs.delete(grid_out._id)
+            for size, rendition in rendered.items():
+                fs.put(
+                    rendition,
+                    filename=self.rendition_name(size),
+                    content_type="image/webp",
+                    image=str(self.pk),
+                    version=self.version,
+                    size=size,
+                )
+        return rendered
+
+    def clear_renditions(self):
+        fs = self._rendition_fs()
+        for grid_out in fs.find({"image": str(self.pk)}):
+            fs.delete(grid_out._id)
+        Image._renditions.prune(lambda key: key[0] == str(self.pk))
+
+    def transform(self, pipeline):
+        """
+        applies an ImageTransform: the data is decoded once, every operation
+        is applied, and the result is written back as a new version
+        """
+        if pipeline and (raw_data := self.read()):
+            with ImageTools.open(io.BytesIO(raw_data)) as img:
+                img = pipeline.apply(img)
+                img_byte_arr = io.BytesIO()
+                img.save(img_byte_arr, format="WEBP")
+            # before the save, which queues the new version's renditions
+            self.clear_renditions()
+            self.write(img_byte_arr.getvalue())
             self.save()
             self.data.seek(0)  # Reset the data stream position to the beginning
 
+    def rotate(self, amount=-90):
+        self.transform(ImageTransform().rotate(amount))
+
     def flip(self, horizontal=True, vertical=True):
-        if raw_data := self.read():
-            img = ImageTools.open(io.BytesIO(raw_data))
-            if horizontal:
-                img = img.transpose(ImageTools.FLIP_LEFT_RIGHT)
-            if vertical:
-                img = img.transpose(ImageTools.FLIP_TOP_BOTTOM)
-            flipped_img_byte_arr = io.BytesIO()
-            img.save(flipped_img_byte_arr, format="WEBP")
-            self.data.delete()
-            self.data.put(flipped_img_byte_arr.getvalue(), content_type="image/webp")
-            self.data.seek(0)
+        self.transform(ImageTransform().flip(horizontal=horizontal, vertical=vertical))
 
     ###############################################################
     ##                    VERIFICATION METHODS                   ##
     ###############################################################
+    @classmethod
+    def auto_pre_init(cls, sender, document, **kwargs):
+        # documents loaded from the database carry _cls; skip the refetch that
+        # would otherwise undo a projection by filling in every missing field
+        if "_cls" in kwargs.get("values", {}):
+            return
+        super().auto_pre_init(sender, document, **kwargs)
+
     @classmethod
     def auto_pre_save(cls, sender, document, **kwargs):
         super().auto_pre_save(sender, document, **kwargs)
         document.pre_save_tags()
+        document.pre_save_tag_facets()
+        document.pre_save_renditions()
 
-    # @classmethod
-    # def auto_post_save(cls, sender, document, **kwargs):
-    #     super().auto_post_save(sender, document, **kwargs)
+    @classmethod
+    def auto_post_save(cls, sender, document, **kwargs):
+        super().auto_post_save(sender, document, **kwargs)
+        document.post_save_tag_facets()
+        document.post_save_renditions()
 
     # def clean(self):
     #     super().clean()
@@ -202,4 +825,34 @@ IMPORTANT: The image MUST NOT contain any TEXT.
     ################### verify associations ##################
     def pre_save_tags(self):
         # log("=== Pre Save Tags ===", self.tags)
-        self.tags = [t.lower() for t in self.tags if t]
+        self.tags = self.normalize_tags(self.tags)
+
+    def _stored_tags(self):
+        if not self.pk:
+            return []
+        doc = self._get_collection().find_one({"_id": self.pk}, {"tags": 1})
+        return (doc or {}).get("tags", [])
+
+    def pre_save_tag_facets(self):
+        # the stored tags are only read back when the tags were changed
+        changed = self._created or any(
+            f == "tags" or f.startswith("tags.") for f in self._get_changed_fields()
+        )
+        self._tag_facets_delta = (
+            (list(self.tags), self._stored_tags()) if changed else None
+        )
+
+    def post_save_tag_facets(self):
+        # retag() sends post_save without a save, and so without a delta
+        if delta := getattr(self, "_tag_facets_delta", None):
+            self._tag_facets_delta = None
+            tag_facets.apply(added=delta[0], removed=delta[1])
+
+    def pre_save_renditions(self):
+        self._renditions_stale = self._created or "data" in self._get_changed_fields()
+
+    def post_save_renditions(self):
+        # precompute the new version's renditions off the request path
+        if getattr(self, "_renditions_stale", False):
+            self._renditions_stale = False
+            renditions.enqueue([self])
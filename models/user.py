@@ -2,11 +2,15 @@ from autonomous import log
 from autonomous.auth.user import AutoUser
 from autonomous.model.autoattr import (
     BoolAttr,
+    IntAttr,
 )
 
 
 class User(AutoUser):
     admin = BoolAttr(default=False)
+    # bumped on every save; sessions compare it to tell a stale payload.
+    # last_updated cannot be used, AutoModel resets it whenever a user loads
+    revision = IntAttr(default=0)
 
     ## MARK: - Verification Methods
     ###############################################################
@@ -17,9 +21,10 @@ class User(AutoUser):
     #     log("Auto Pre Save World")
     #     super().auto_post_init(sender, document, **kwargs)
 
-    # @classmethod
-    # def auto_pre_save(cls, sender, document, **kwargs):
-    #     super().auto_pre_save(sender, document, **kwargs)
+    @classmethod
+    def auto_pre_save(cls, sender, document, **kwargs):
+        super().auto_pre_save(sender, document, **kwargs)
+        document.pre_save_revision()
 
     # @classmethod
     # def auto_post_save(cls, sender, document, **kwargs):
@@ -27,3 +32,7 @@ class User(AutoUser):
 
     # def clean(self):
     #     super().clean()
+
+    ################### verify methods ##################
+    def pre_save_revision(self):
+        self.revision = (self.revision or 0) + 1
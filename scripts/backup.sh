@@ -1,4 +1,21 @@
-curl https://world.stevenamoore.dev/admin/dbdump > /dev/null
-cp -f /root/prod/world-prod/app/dbbackups/* /root/dev/world-backend-dev/app/dbbackups/ > /dev/null
-curl https://backenddev.world.stevenamoore.dev/admin/dbload > /dev/null
-docker system prune -af > /dev/null
\ No newline at end of file
+#!/usr/bin/env bash
+# Streams a backup of prod straight into dev; nothing is staged on disk.
+# Incremental from the watermark kept in prod's dbbackups/state.json, unless
+# the first argument is --full (which also replaces dev's collections).
+# Remaining arguments are passed to both sides, e.g. --collections image fs
+# The watermark only moves once the restore has succeeded.
+set -euo pipefail
+PROD_API=${PROD_API:-world-prod_api}
+DEV_API=${DEV_API:-world-backend-dev_api}
+DUMP_ARGS=""
+RESTORE_ARGS=""
+if [ "${1:-}" = "--full" ]; then
+    shift
+    DUMP_ARGS="--full"
+    RESTORE_ARGS="--drop"
+fi
+
+docker exec $PROD_API python -m utils.backup dump --state dbbackups/state.json $DUMP_ARGS "$@" \
+    | docker exec -i $DEV_API python -m utils.backup restore $RESTORE_ARGS "$@"
+docker exec $PROD_API python -m utils.backup commit --state dbbackups/state.json
+docker system prune -af > /dev/null
@@ -0,0 +1,378 @@
+"""
+benchmark.py - offline benchmarks for the image and proxy hot paths
+
+Runs against mongomock (with GridFS) and in-process fake upstreams, so no
+database, Redis or network is needed. Each benchmark runs in its own
+subprocess, which keeps the peak RSS of one from leaking into the next.
+
+mongomock scans collections in Python, so the 100k get_image_list cases take
+several minutes and mostly measure mongomock. Pass --mongo to run the same
+benchmarks against a real (throwaway) MongoDB database instead.
+
+Usage:
+    python scripts/benchmark.py                       # run everything
+    python scripts/benchmark.py -k resize -k loader   # names containing either
+    python scripts/benchmark.py --save scripts/benchmark_baseline.json
+    python scripts/benchmark.py --compare scripts/benchmark_baseline.json
+    python scripts/benchmark.py --mongo mongodb://localhost:27017 -k image_list
+
+Reported per benchmark: throughput (ops/s), p50 and p99 latency (ms) and the
+subprocess' peak RSS (MB). --compare exits with status 1 if any benchmark's
+p50 or throughput is more than --tolerance worse than the baseline.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "scripts", "benchmark_baseline.json")
+
+
+#################################################################
+#                           Fixtures                            #
+#################################################################
+
+
+def _connect():
+    sys.path.insert(0, ROOT)
+    # no Redis here to queue rendition precompute jobs on
+    os.environ.setdefault("RENDITION_PRECOMPUTE", "0")
+    import mongomock
+    from mongomock.gridfs import enable_gridfs_integration
+
+    enable_gridfs_integration()
+    # importing automodel registers the default connection; replace it
+    import autonomous.model.automodel  # noqa: F401
+    from autonomous.db import connect, disconnect
+
+    disconnect()
+    if uri := os.environ.get("BENCHMARK_MONGO"):
+        from autonomous.db.connection import get_db
+
+        connect("benchmark_db", host=uri)
+        db = get_db()
+        db.client.drop_database(db.name)
+    else:
+        connect(
+            "benchmark_db",
+            host="mongodb://localhost",
+            mongo_client_class=mongomock.MongoClient,
+        )
+    random.seed(0)
+
+
+def _image_bytes(size=(1024, 1024), format="WEBP"):
+    from PIL import Image as ImageTools
+
+    img = ImageTools.effect_mandelbrot(size, (-2, -1.5, 1, 1.5), 64).convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def _image():
+    from models.image import Image
+
+    image = Image(prompt="benchmark", tags=["benchmark"])
+    image.write(_image_bytes())
+    image.save()
+    return image
+
+
+def _fake_transport(content, content_type):
+    import httpx
+
+    return httpx.MockTransport(
+        lambda request: httpx.Response(
+            200,
+            stream=httpx.ByteStream(content),
+            headers={"Content-Type": content_type, "Content-Length": str(len(content))},
+        )
+    )
+
+
+#################################################################
+#                          Benchmarks                           #
+#################################################################
+# Each benchmark returns (operation, iterations). Setup happens before the
+# returned operation is timed.
+
+
+def resize(size, cached):
+    def setup():
+        from models.image import Image
+
+        image = _image()
+
+        def operation():
+            # the in-process LRU is always skipped; "cold" also rebuilds
+            Image._renditions.clear()
+            if not cached:
+                image.clear_renditions()
+            image.resize(size)
+
+        return operation, 50
+
+    return setup
+
+
+def image_list(count, tags):
+    def setup():
+        from models.image import Image
+
+        vocabulary = [f"tag{i}" for i in range(50)]
+        collection = Image._get_collection()
+        for start in range(0, count, 10000):
+            collection.insert_many(
+                [
+                    {
+                        "_cls": "Image",
+                        "prompt": f"prompt {i}",
+                        "tags": random.sample(vocabulary, 3),
+                    }
+                    for i in range(start, min(start + 10000, count))
+                ]
+            )
+
+        def operation():
+            Image.get_image_list(max=10, tags=["tag1"] if tags else None)
+
+        return operation, max(3, 30000 // count)
+
+    return setup
+
+
+def image_page(count):
+    def setup():
+        from models.image import Image
+
+        image_list(count, False)()
+        # a cursor halfway through, as reached by scrolling the gallery
+        cursor = str(
+            Image._get_collection()
+            .find({}, {"_id": 1})
+            .sort("_id", -1)[count // 2]["_id"]
+        )
+
+        def operation():
+            Image.page(cursor=cursor, limit=48)
+
+        return operation, max(3, 30000 // count)
+
+    return setup
+
+
+def from_url():
+    from models.image import Image
+
+    import httpx
+
+    jpeg = _image_bytes((1600, 1200), "JPEG")
+    Image._http_client = httpx.Client(transport=_fake_transport(jpeg, "image/jpeg"))
+
+    def operation():
+        Image.from_url("http://images.test/benchmark.jpg", tags=["benchmark"])
+
+    return operation, 30
+
+
+def proxy():
+    sys.path.insert(0, os.path.join(ROOT, "app"))
+    import httpx
+    from app import create_app
+    from views import _proxy
+
+    app = create_app()
+    page = b"<div>" + b"x" * 4096 + b"</div>"
+    api = _proxy.Upstream("http://api.test", name="api")
+    api._client = httpx.Client(
+        base_url="http://api.test", transport=_fake_transport(page, "text/html")
+    )
+    _proxy._upstreams["api"] = api
+    client = app.test_client()
+
+    def operation():
+        response = client.get("/api/home")
+        assert response.status_code == 200
+        response.get_data()
+
+    return operation, 500
+
+
+def loader():
+    import importlib.util
+
+    from flask import Flask
+
+    from models.user import User
+
+    spec = importlib.util.spec_from_file_location(
+        "api_utilities", os.path.join(ROOT, "api", "views", "_utilities.py")
+    )
+    utilities = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(utilities)
+
+    user = User(name="benchmark", email="benchmark@test", state="authenticated")
+    user.save()
+    image = _image()
+    app = Flask(__name__)
+
+    @app.route("/load", methods=("POST",))
+    def load():
+        u, obj = utilities.loader()
+        return str(obj.pk)
+
+    client = app.test_client()
+    payload = {"user": str(user.pk), "model": "image", "pk": str(image.pk)}
+
+    def operation():
+        assert client.post("/load", json=payload).status_code == 200
+
+    return operation, 500
+
+
+BENCHMARKS = {
+    **{
+        f"resize_{size}_{'gridfs' if cached else 'cold'}": resize(size, cached)
+        for size in ("thumbnail", "small", "medium", "large")
+        for cached in (False, True)
+    },
+    **{
+        f"get_image_list_{count // 1000}k{'_tags' if tags else ''}": image_list(
+            count, tags
+        )
+        for count in (1000, 10000, 100000)
+        for tags in (False, True)
+    },
+    **{f"image_page_{count // 1000}k": image_page(count) for count in (1000, 10000)},
+    "from_url": from_url,
+    "proxy_api": proxy,
+    "loader": loader,
+}
+
+
+#################################################################
+#                           Running                             #
+#################################################################
+
+
+def run(name):
+    """
+    Runs one benchmark in this process and returns its measurements
+    """
+    _connect()
+    operation, iterations = BENCHMARKS[name]()
+    operation()  # warm up
+    timings = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        began = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / elapsed, 2),
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p99_ms": round(
+            timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 3
+        ),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def compare(results, baseline, tolerance, names=None):
+    """
+    Regressions of `results` against `baseline`. A baseline benchmark among
+    `names` (default: all) with no result, because it failed or no longer
+    exists, counts as one.
+    """
+    regressions = [
+        f"{name}: no result"
+        for name in baseline
+        if name not in results and (names is None or name in names)
+    ]
+    for name, result in results.items():
+        if not (base := baseline.get(name)):
+            continue
+        if result["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {base['p50_ms']}ms -> {result['p50_ms']}ms"
+            )
+        if result["ops_per_sec"] < base["ops_per_sec"] / (1 + tolerance):
+            regressions.append(
+                f"{name}: {base['ops_per_sec']} -> {result['ops_per_sec']} ops/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-k", action="append", help="run benchmarks containing this")
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="PATH", nargs="?", const=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--mongo", metavar="URI", help="use this MongoDB, not mongomock"
+    )
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # quiet the app's logging so it does not mix with the result
+        sys.stdout, stdout = open(os.devnull, "w"), sys.stdout
+        result = run(args.run)
+        stdout.write(json.dumps(result))
+        return 0
+
+    if args.mongo:
+        os.environ["BENCHMARK_MONGO"] = args.mongo
+    names = [n for n in BENCHMARKS if not args.k or any(k in n for k in args.k)]
+    results, failed = {}, []
+    print(f"{'benchmark':<28}{'ops/s':>12}{'p50 ms':>12}{'p99 ms':>12}{'rss MB':>9}")
+    for name in names:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", name],
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+        )
+        if process.returncode:
+            print(f"{name:<28}failed\n{process.stderr}")
+            failed.append(name)
+            continue
+        results[name] = result = json.loads(process.stdout.strip().splitlines()[-1])
+        print(
+            f"{name:<28}{result['ops_per_sec']:>12}{result['p50_ms']:>12}"
+            f"{result['p99_ms']:>12}{result['peak_rss_mb']:>9}"
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        names = [n for n in baseline if not args.k or any(k in n for k in args.k)]
+        regressions = compare(results, baseline, args.tolerance, names)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions or failed else 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+import_report.py - startup import cost of the app, api and tasks services
+
+Runs `create_app()` for each service in a fresh interpreter with
+`python -X importtime`, laid out the way the containers mount it (the
+service directory as the working directory, with models/, utils/ etc. next
+to it), and reports the time spent importing each top-level package and the
+slowest individual modules.
+
+Usage:
+    python scripts/import_report.py              # all three services
+    python scripts/import_report.py api -n 30    # one service, top 30 modules
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ("app", "api", "tasks")
+_line = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+_startup = """
+import time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def measure(service):
+    """
+    Returns (seconds to create the app, [(module, self us, cumulative us)])
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _startup],
+        cwd=os.path.join(ROOT, service),
+        env={**os.environ, "PYTHONPATH": ROOT},
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode:
+        raise RuntimeError(f"{service} failed to start:\n{process.stderr}")
+    modules = [
+        (m.group(4), int(m.group(1)), int(m.group(2)))
+        for m in map(_line.match, process.stderr.splitlines())
+        if m
+    ]
+    return float(process.stdout.strip().splitlines()[-1]), modules
+
+
+def report(service, top=15):
+    seconds, modules = measure(service)
+    packages = defaultdict(int)
+    for name, own, _ in modules:
+        packages[name.split(".")[0]] += own
+    print(f"\n== {service}: create_app() in {seconds * 1000:.0f} ms ==")
+    print(f"{'package':<40}{'ms':>10}")
+    for name, own in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        print(f"{name:<40}{own / 1000:>10.1f}")
+    print(f"\n{'module':<56}{'self ms':>10}{'total ms':>10}")
+    for name, own, total in sorted(modules, key=lambda m: -m[1])[:top]:
+        print(f"{name:<56}{own / 1000:>10.1f}{total / 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("services", nargs="*", help="any of app, api and tasks")
+    parser.add_argument("-n", type=int, default=15, help="rows per table")
+    args = parser.parse_args()
+    if unknown := set(args.services) - set(SERVICES):
+        parser.error(f"unknown services: {', '.join(sorted(unknown))}")
+    for service in args.services or SERVICES:
+        report(service, top=args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,57 @@
+import json
 import os
+import time
 
 from config import Config
-from flask import Flask, get_template_attribute, request
+from flask import (
+    Flask,
+    Response,
+    current_app,
+    get_template_attribute,
+    request,
+    stream_with_context,
+)
 
 import tasks
 from autonomous import log
 from autonomous.model.automodel import AutoModel
 from autonomous.tasks import AutoTasks
 from models.user import User
+from utils import metrics
+from utils.connections import redis_connection
+
+
+def _task_fragment(taskid, status, return_value=None, error=""):
+    if status == "finished":
+        return get_template_attribute("shared/_tasks.html", "completetask")(
+            **return_value
+        )
+    elif status == "failed":
+        return f"<p>Generation Error for task#: {taskid} </p> </p>{error}</p>"
+    else:
+        return get_template_attribute("shared/_tasks.html", "checktask")(taskid)
+
+
+def _owner_key(taskid):
+    return f"autotask:owner:{taskid}"
+
+
+def _started(taskid):
+    """
+    Records the user who started the task, the only one who may stream it,
+    and returns the fragment that follows it
+    """
+    options = request.get_json(silent=True) or {}
+    if user := options.get("user"):
+        redis_connection().set(
+            _owner_key(taskid), str(user), ex=current_app.config["TASK_OWNER_TTL"]
+        )
+    return get_template_attribute("shared/_taskstream.html", "taskstream")(taskid)
+
+
+def _sse(event, data):
+    lines = "".join(f"data: {line}\n" for line in str(data).splitlines() or [""])
+    return f"event: {event}\n{lines}\n"
 
 
 def create_app():
@@ -23,21 +67,70 @@ def create_app():
         ),
     )
     def checktask(taskid):
-        if task := AutoTasks().get_task(taskid):
+        if (task := AutoTasks().get_task(taskid)) and task.job:
             # log(task.status, task.return_value, task.id)
-            if task.status == "finished":
-                return get_template_attribute("shared/_tasks.html", "completetask")(
-                    **task.return_value
-                )
-            elif task.status == "failed":
-                return f"<p>Generation Error for task#: {task.id} </p> </p>{task.result.get('error', '')}</p>"
-            else:
-                return get_template_attribute("shared/_tasks.html", "checktask")(
-                    task.id
-                )
+            return _task_fragment(
+                task.id,
+                task.status,
+                return_value=task.return_value,
+                error=task.result.get("error", ""),
+            )
         else:
             return "No task found"
 
+    @app.route("/stream/<taskid>", methods=("GET",))
+    def streamtask(taskid):
+        """
+        Server-Sent Events stream that pushes the task's completetask fragment
+        once as a `complete` event, to the user who started the task only. If
+        the task is still running when the stream times out, the checktask
+        fragment is pushed instead so the page falls back to polling
+        /checktask.
+        """
+        owner = redis_connection().get(_owner_key(taskid))
+        if not owner or owner.decode() != request.args.get("user"):
+            return "No task found", 404
+        autotasks = AutoTasks()
+
+        def events():
+            pubsub = autotasks._connection.pubsub(ignore_subscribe_messages=True)
+            # subscribe before checking the status so a completion in between is not missed
+            pubsub.subscribe(tasks.task_channel(taskid))
+            try:
+                task = autotasks.get_task(taskid)
+                if not task.job:
+                    yield _sse("complete", "No task found")
+                    return
+                if task.status in ("finished", "failed"):
+                    yield _sse(
+                        "complete",
+                        _task_fragment(
+                            task.id,
+                            task.status,
+                            return_value=task.return_value,
+                            error=task.result.get("error", ""),
+                        ),
+                    )
+                    return
+                deadline = time.monotonic() + app.config["TASK_STREAM_TIMEOUT"]
+                while (remaining := deadline - time.monotonic()) > 0:
+                    if message := pubsub.get_message(
+                        timeout=min(app.config["TASK_STREAM_KEEPALIVE"], remaining)
+                    ):
+                        payload = json.loads(message["data"])
+                        yield _sse("complete", _task_fragment(taskid, **payload))
+                        return
+                    yield ": keepalive\n\n"
+                yield _sse("complete", _task_fragment(taskid, "running"))
+            finally:
+                pubsub.close()
+
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     @app.route("/generate/<string:model>/<string:pk>", methods=("POST",))
     def generate(model, pk):
         task = (
@@ -49,7 +142,7 @@ def create_app():
             )
             .result
         )
-        return get_template_attribute("shared/_tasks.html", "checktask")(task["id"])
+        return _started(task["id"])
 
     @app.route("/generate/image/<string:model>/<string:pk>", methods=("POST",))
     def image_generate_task(model, pk):
@@ -62,6 +155,67 @@ def create_app():
             )
             .result
         )
-        return get_template_attribute("shared/_tasks.html", "checktask")(task["id"])
+        return _started(task["id"])
+
+    @app.route("/generate/images", methods=("POST",))
+    def image_batch_generate_task():
+        task = (
+            AutoTasks()
+            .task(
+                tasks._generate_image_batch_task,
+                prompts=request.json.get("prompts", []),
+                tags=request.json.get("tags"),
+            )
+            .result
+        )
+        return _started(task["id"])
+
+    @app.route("/transform/image/<string:pk>", methods=("POST",))
+    def image_transform_task(pk):
+        task = (
+            AutoTasks()
+            .task(
+                tasks._transform_image_task,
+                pk=pk,
+                operations=request.json.get("operations", []),
+            )
+            .result
+        )
+        return _started(task["id"])
+
+    @app.route("/renditions/images", methods=("POST",))
+    def image_renditions_task():
+        options = request.get_json(silent=True) or {}
+        task = (
+            AutoTasks()
+            .task(
+                tasks._build_renditions_task,
+                pks=options.get("pks"),
+                force=bool(options.get("force")),
+            )
+            .result
+        )
+        return _started(task["id"])
+
+    @app.route("/dedupe/images", methods=("POST",))
+    def image_dedupe_task():
+        options = request.get_json(silent=True) or {}
+        task = (
+            AutoTasks()
+            .task(
+                tasks._dedupe_images_task,
+                distance=options.get("distance"),
+                dry_run=bool(options.get("dry_run")),
+            )
+            .result
+        )
+        return _started(task["id"])
+
+    @app.route("/progress/<taskid>", methods=("GET", "POST"))
+    def taskprogress(taskid):
+        if (task := AutoTasks().get_task(taskid)) and task.job:
+            return {"status": task.status, **task.job.get_meta().get("progress", {})}
+        return {"status": "missing"}
 
+    metrics.install(app, rq_connection=redis_connection())
     return app
@@ -14,3 +14,7 @@ class Config:
     DEBUG = os.environ.get("DEBUG", False)
     TESTING = os.environ.get("TESTING", False)
     TRAP_HTTP_EXCEPTIONS = os.environ.get("TRAP_HTTP_EXCEPTIONS", False)
+    TASK_STREAM_TIMEOUT = float(os.environ.get("TASK_STREAM_TIMEOUT", 60))
+    TASK_STREAM_KEEPALIVE = float(os.environ.get("TASK_STREAM_KEEPALIVE", 15))
+    # how long the user who started a task is remembered for its stream
+    TASK_OWNER_TTL = int(os.environ.get("TASK_OWNER_TTL", 24 * 3600))
@@ -1,14 +1,112 @@
 import json
+from functools import wraps
+
+from rq import get_current_job
 
 from autonomous import log
 from autonomous.model.automodel import AutoModel
 from autonomous.tasks import AutoTasks
+from models.image import Image
 from models.user import User
+from utils import renditions
+from utils.metrics import timed_job
+
+# imported for their save hooks, so saves here update the api
+from utils import autocomplete, fragments, membership  # noqa: F401
+from utils.transforms import ImageTransform
+
+
+def task_channel(taskid):
+    return f"autotask:{taskid}"
+
+
+def notify(func):
+    """
+    Publishes the outcome of the wrapped job on its task channel, so that
+    /stream/<taskid> can push the result instead of being polled for it
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        job = get_current_job()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if job:
+                payload = {"status": "failed", "error": str(e)}
+                job.connection.publish(task_channel(job.id), json.dumps(payload))
+            raise
+        if job:
+            payload = {"status": "finished", "return_value": result}
+            job.connection.publish(
+                task_channel(job.id), json.dumps(payload, default=str)
+            )
+        return result
+
+    return wrapper
 
 
 ####################################################################################################
 # Tasks
 ####################################################################################################
+@notify
+@timed_job
+def _generate_image_batch_task(prompts, tags=None):
+    job = get_current_job()
+    progress = {"done": 0, "failed": 0, "total": len(prompts)}
+
+    def _progress(index, image_obj):
+        progress["done"] += 1
+        if not image_obj:
+            progress["failed"] += 1
+        if job:
+            job.meta["progress"] = progress
+            job.save_meta()
+
+    images = Image.generate_batch(prompts, tags=tags, progress=_progress)
+    return {
+        "images": [str(i.pk) if i else None for i in images],
+        "urls": [i.url() if i else None for i in images],
+        **progress,
+    }
+
+
+@notify
+@timed_job
+def _transform_image_task(pk, operations):
+    try:
+        pipeline = ImageTransform(operations)
+    except ValueError as e:
+        return {"error": str(e)}
+    if image := Image.get(pk):
+        try:
+            image.transform(pipeline)
+        except ValueError as e:
+            return {"error": str(e)}
+        return {"url": image.url()}
+    return {"error": f"Image {pk} not found"}
+
+
+@notify
+@timed_job
+def _build_renditions_task(pks=None, force=False):
+    job = get_current_job()
+
+    def _progress(done, total):
+        if job:
+            job.meta["progress"] = {"done": done, "total": total}
+            job.save_meta()
+
+    return renditions.build(pks=pks, force=force, progress=_progress)
+
+
+@notify
+@timed_job
+def _dedupe_images_task(distance=None, dry_run=False):
+    return Image.dedupe(distance=distance, dry_run=dry_run)
+
+
+# @notify
 # def _generate_task(model, pk):
 #     if Model := AutoModel.get_model(model):
 #         obj = Model.get(pk)
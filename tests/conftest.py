@@ -4,16 +4,17 @@ import sys
 import mongomock
 import pytest
 from autonomous.db import connect, disconnect
+from flask import Flask
 from mongomock.gridfs import enable_gridfs_integration
 
-from app import create_app
-from models.user import User
-from models.world import World
-
 # # Add the 'app' directory to the Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
 enable_gridfs_integration()
 
+from models.user import User  # noqa: E402
+from utils import connections  # noqa: E402
+
 
 @pytest.fixture(scope="module", autouse=True)
 def test_db():
@@ -25,3 +26,27 @@ def test_db():
     )
     yield
     disconnect()
+
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    """
+    A fakeredis instance standing in for the Redis every service shares
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(connections, "_redis", redis)
+    return redis
+
+
+@pytest.fixture
+def api_client(shared_redis, monkeypatch):
+    """
+    A test client for the api service's image routes
+    """
+    monkeypatch.syspath_prepend(os.path.join(ROOT, "api"))
+    from views.image import image_endpoint
+
+    app = Flask(__name__, template_folder=os.path.join(ROOT, "templates"))
+    app.register_blueprint(image_endpoint, url_prefix="/image")
+    return app.test_client()
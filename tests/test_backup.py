@@ -0,0 +1,108 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import gridfs
+import mongomock
+import pytest
+
+from utils import backup
+
+
+def _now(**delta):
+    # mongo hands back naive UTC datetimes
+    return (datetime.now(timezone.utc) + timedelta(**delta)).replace(tzinfo=None)
+
+
+@pytest.fixture
+def databases(monkeypatch):
+    monkeypatch.setenv("BACKUP_OVERLAP", "0")
+    client = mongomock.MongoClient()
+    source, target = client.backup_source, client.backup_target
+    source.image.insert_many(
+        [
+            {"_id": name, "tags": [name], "last_updated": _now(days=-2)}
+            for name in ("kept", "changed", "deleted")
+        ]
+    )
+    source.settings.insert_one({"_id": "site", "theme": "dark"})
+    gridfs.GridFS(source).put(b"original", filename="original")
+    # left over in the target from before; a full restore with drop removes it
+    target.image.insert_one({"_id": "stale", "last_updated": _now(days=-9)})
+    return source, target
+
+
+def _round_trip(source, target, since=None, drop=False):
+    archive = io.BytesIO()
+    manifest = backup.dump(archive, db=source, since=since)
+    archive.seek(0)
+    return manifest, backup.restore(archive, db=target, drop=drop, batch_size=2)
+
+
+def _snapshot(db):
+    return {
+        name: sorted(db[name].find(), key=lambda d: str(d["_id"]))
+        for name in db.list_collection_names()
+    }
+
+
+def test_full_round_trip(databases):
+    source, target = databases
+    manifest, counts = _round_trip(source, target, drop=True)
+    assert manifest["since"] is None
+    assert counts == {"fs.chunks": 1, "fs.files": 1, "image": 3, "settings": 1}
+    assert _snapshot(target) == _snapshot(source)
+    assert gridfs.GridFS(target).find_one({"filename": "original"}).read() == (
+        b"original"
+    )
+
+
+def test_incremental_round_trip(databases):
+    source, target = databases
+    manifest, _ = _round_trip(source, target, drop=True)
+
+    source.image.update_one(
+        {"_id": "changed"}, {"$set": {"tags": ["new"], "last_updated": _now()}}
+    )
+    source.image.insert_one({"_id": "added", "tags": [], "last_updated": _now()})
+    source.image.delete_one({"_id": "deleted"})
+    gridfs.GridFS(source).put(b"second", filename="second")
+    # drop is ignored for an incremental archive
+    _, counts = _round_trip(source, target, since=manifest["until"], drop=True)
+
+    # only what changed since the watermark; settings has no change field
+    assert counts == {"fs.chunks": 1, "fs.files": 1, "image": 2, "settings": 1}
+    assert _snapshot(target) == _snapshot(source)
+    assert target.image.find_one({"_id": "changed"})["tags"] == ["new"]
+    assert not target.image.find_one({"_id": "deleted"})
+
+
+def test_watermark_moves_only_on_commit(databases, tmp_path, monkeypatch):
+    source, _ = databases
+    monkeypatch.setattr(backup, "_database", lambda: source)
+    state = tmp_path / "state.json"
+
+    def _dump(*args):
+        out = SimpleNamespace(buffer=io.BytesIO())
+        monkeypatch.setattr(backup.sys, "stdout", out)
+        backup.main(["dump", "--state", str(state), *args])
+        out.buffer.seek(0)
+        return backup.restore(out.buffer, db=mongomock.MongoClient().scratch)
+
+    assert _dump()["image"] == 3
+    assert not state.exists()
+    pending = json.loads((tmp_path / "state.json.pending").read_text())
+
+    # the restore "failed": the next dump starts from the old watermark
+    assert _dump()["image"] == 3
+    backup.main(["commit", "--state", str(state)])
+    assert not (tmp_path / "state.json.pending").exists()
+    assert json.loads(state.read_text())["until"] >= pending["until"]
+
+    assert backup._load_state(str(state)).tzinfo is not None
+    assert "image" not in _dump()
+    assert _dump("--full")["image"] == 3
+    (tmp_path / "state.json.pending").unlink()
+    with pytest.raises(SystemExit):
+        backup.main(["commit", "--state", str(state)])
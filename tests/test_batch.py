@@ -0,0 +1,76 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+from models.image import Image
+from utils.fakes import FakeImageAgent
+
+
+@pytest.fixture
+def agent(shared_redis, monkeypatch):
+    # no rate limit, so only max_workers bounds the calls in flight
+    monkeypatch.setenv("IMAGE_AGENT_RATE", "0")
+    agent = FakeImageAgent(delay=0.05, size=64, fail_on="refuse")
+    monkeypatch.setattr(Image, "_client", agent)
+    monkeypatch.setattr(Image, "_guarded_client", None)
+    return agent
+
+
+@pytest.fixture
+def tasks_module(monkeypatch):
+    # tasks/tasks.py is imported as `tasks` inside the tasks service
+    path = os.path.join(os.path.dirname(__file__), "..", "tasks", "tasks.py")
+    spec = importlib.util.spec_from_file_location("tasks", path)
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, "tasks", module)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_batch_respects_max_workers(agent):
+    prompts = [f"workers {i}" for i in range(8)]
+    images = Image.generate_batch(prompts, max_workers=2)
+    assert agent.calls == 8
+    assert 1 < agent.max_in_flight <= 2
+    assert all(image.pk for image in images)
+    assert [image.prompt for image in images] == prompts
+
+
+def test_batch_reuses_duplicates_within_the_batch(agent):
+    before = Image.objects.count()
+    images = Image.generate_batch(
+        ["dedupe castle", {"prompt": "dedupe castle", "tags": ["keep"]}, "dedupe moat"],
+        tags=["batch"],
+    )
+    assert images[0].pk == images[1].pk != images[2].pk
+    assert Image.objects.count() == before + 2
+    assert set(Image.get(images[0].pk).tags) == {"batch", "keep"}
+
+
+def test_batch_survives_partial_failure(agent):
+    seen = []
+    images = Image.generate_batch(
+        ["partial one", "partial refuse", "partial three"],
+        progress=lambda index, image: seen.append((index, image is not None)),
+    )
+    assert images[1] is None
+    assert images[0].pk and images[2].pk
+    assert sorted(seen) == [(0, True), (1, False), (2, True)]
+
+
+def test_generate_images_job_records_progress(agent, shared_redis, tasks_module):
+    from rq import Queue
+
+    queue = Queue(is_async=False, connection=shared_redis)
+    job = queue.enqueue(
+        tasks_module._generate_image_batch_task,
+        prompts=["job one", "job refuse", "job three"],
+        tags=["job"],
+    )
+    result = job.return_value()
+    assert result["total"] == 3 and result["done"] == 3 and result["failed"] == 1
+    assert result["images"][1] is None and result["urls"][1] is None
+    assert all(Image.get(pk) for pk in (result["images"][0], result["images"][2]))
+    assert job.get_meta()["progress"] == {"done": 3, "failed": 1, "total": 3}
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from models.image import Image
+from utils.fakes import FakeImageAgent
+
+
+def _stored(prompt, tags):
+    image = Image(tags=tags)
+    image.write(FakeImageAgent(size=64).generate(prompt))
+    image.save()
+    return image
+
+
+def test_backfilled_hashes_reach_incremental_backups(shared_redis):
+    image = _stored("backfill", ["backfill"])
+    before = datetime.now() - timedelta(days=1)
+    # as stored before perceptual hashes existed
+    Image._get_collection().update_one(
+        {"_id": image.pk},
+        {"$set": {"dhash": "", "dhash_bands": [], "last_updated": before}},
+    )
+    assert Image.dedupe(dry_run=True)["hashed"] == 1
+    doc = Image._get_collection().find_one({"_id": image.pk})
+    assert doc["dhash"] and doc["dhash_bands"]
+    assert doc["last_updated"] > before
+
+
+def test_duplicates_fold_into_the_oldest_image(shared_redis):
+    keeper = _stored("dedupe", ["first"])
+    duplicate = _stored("dedupe", ["second"])
+    other = _stored("something else", ["third"])
+    result = Image.dedupe()
+    assert result["removed"] == 1
+    assert not Image.get(duplicate.pk)
+    assert set(Image.get(keeper.pk).tags) == {"first", "second"}
+    assert Image.get(other.pk)
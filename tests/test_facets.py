@@ -0,0 +1,73 @@
+from collections import Counter
+
+import pytest
+
+from models.image import Image
+from utils.facets import tag_facets
+
+
+def _recount():
+    return Counter(tag for image in Image.objects.only("tags") for tag in image.tags)
+
+
+def _summary():
+    return dict(tag_facets.counts(limit=1000)[1])
+
+
+@pytest.fixture
+def facets(shared_redis, monkeypatch):
+    # each test module gets a fresh database, so forget an earlier build
+    monkeypatch.setattr(tag_facets, "_built", False)
+    monkeypatch.setattr(tag_facets, "_indexed", False)
+    Image.objects.delete()
+    tag_facets.rebuild()
+    return tag_facets
+
+
+def test_summary_follows_save_retag_and_delete(facets):
+    castle, moat = Image(tags=["castle", "stone"]), Image(tags=["moat", "stone"])
+    castle.save()
+    moat.save()
+    assert _summary() == _recount() == {"castle": 1, "moat": 1, "stone": 2}
+
+    Image.retag([castle.pk, moat.pk], add=["keep"], remove=["stone"])
+    assert _summary() == _recount() == {"castle": 1, "moat": 1, "keep": 2}
+
+    castle = Image.get(castle.pk)
+    castle.tags = ["castle", "ruin"]
+    castle.save()
+    assert _summary() == _recount() == {"castle": 1, "moat": 1, "keep": 1, "ruin": 1}
+
+    moat.delete()
+    assert _summary() == _recount() == {"castle": 1, "ruin": 1}
+
+
+def test_summary_is_built_on_first_use(facets, monkeypatch):
+    Image(tags=["early"]).save()
+    # as for a fresh deploy: no summary marker yet, so saves are not applied
+    facets.markers.delete_many({})
+    monkeypatch.setattr(facets, "_built", False)
+    Image(tags=["early", "late"]).save()
+    assert facets.summary.find_one({"_id": "late"}) is None
+    assert _summary() == {"early": 2, "late": 1}
+
+
+def test_facets_route(api_client, facets):
+    Image(tags=["castle", "stone"]).save()
+    Image(tags=["castle", "moat"]).save()
+    Image(tags=["moat"]).save()
+
+    response = api_client.get("/image/facets?limit=2")
+    assert response.json == {"total": 3, "facets": [["castle", 2], ["moat", 2]]}
+    response = api_client.get("/image/facets?tags=castle")
+    assert response.json == {"total": 2, "facets": [["moat", 1], ["stone", 1]]}
+    # a bare string is one tag, not its letters
+    response = api_client.post("/image/facets", json={"tags": "castle"})
+    assert response.json == {"total": 2, "facets": [["moat", 1], ["stone", 1]]}
+
+
+@pytest.mark.parametrize(
+    "payload", [{"tags": 5}, {"tags": ["castle", 1]}, {"tags": {"castle": 1}}]
+)
+def test_facets_route_rejects_malformed_tags(api_client, facets, payload):
+    assert api_client.post("/image/facets", json=payload).status_code == 400
@@ -0,0 +1,52 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from utils import fragments
+from utils.fragments import FragmentCache, MemoryBackend, RedisBackend
+
+
+class World(SimpleNamespace):
+    pass
+
+
+class User(SimpleNamespace):
+    pass
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    # each render gives a new string, so a cache hit shows up as a repeat
+    counter = itertools.count()
+
+    def _macro(template, macro):
+        return lambda *args: f"render {next(counter)}"
+
+    monkeypatch.setattr(fragments, "get_template_attribute", _macro)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request, renders):
+    if request.param == "redis":
+        request.getfixturevalue("shared_redis")
+        return FragmentCache(RedisBackend(ttl=60))
+    return FragmentCache(MemoryBackend(ttl=60))
+
+
+def test_saves_of_the_user_or_object_invalidate(cache):
+    user, world = User(pk="u1"), World(pk="w1")
+    first = cache.render("t.html", "menu", user, world)
+    assert cache.render("t.html", "menu", user, world) == first
+    cache.invalidate(User(pk="u1"))
+    second = cache.render("t.html", "menu", user, world)
+    assert second != first
+    cache.invalidate(world)
+    assert cache.render("t.html", "menu", user, world) not in (first, second)
+
+
+def test_generation_keys_expire(shared_redis, renders):
+    cache = FragmentCache(RedisBackend(ttl=60))
+    cache.invalidate(World(pk="w1"))
+    ttl = shared_redis.ttl(FragmentCache._generation_key(World(pk="w1")))
+    assert 60 < ttl <= 120
@@ -0,0 +1,106 @@
+import io
+import random
+
+import httpx
+import pytest
+from PIL import Image as ImageTools
+
+from models.image import Image
+
+
+def _png(seed, size=(96, 64)):
+    noise = random.Random(seed).randbytes(12 * 8 * 3)
+    img = ImageTools.frombytes("RGB", (12, 8), noise).resize(
+        size, ImageTools.Resampling.BICUBIC
+    )
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Server:
+    """
+    Answers the image urls the tests fetch; counts the body chunks sent
+    """
+
+    def __init__(self):
+        self.chunks_sent = 0
+
+    def _stream(self, chunks):
+        for chunk in chunks:
+            self.chunks_sent += 1
+            yield chunk
+
+    def __call__(self, request):
+        path = request.url.path
+        if path == "/good.png":
+            return httpx.Response(
+                200, headers={"Content-Type": "image/png"}, content=_png(1)
+            )
+        if path == "/moved.png":
+            return httpx.Response(301, headers={"Location": "/redirected.png"})
+        if path == "/redirected.png":
+            return httpx.Response(
+                200, headers={"Content-Type": "image/png"}, content=_png(2)
+            )
+        if path == "/page.html":
+            return httpx.Response(
+                200, headers={"Content-Type": "text/html"}, content=b"<html></html>"
+            )
+        if path == "/declared-huge.png":
+            return httpx.Response(
+                200,
+                headers={"Content-Type": "image/png", "Content-Length": "999999"},
+                content=b"",
+            )
+        if path == "/endless.png":
+            # no Content-Length: only counting the streamed bytes catches it
+            return httpx.Response(
+                200,
+                headers={"Content-Type": "image/png"},
+                content=self._stream(b"x" * 1024 for _ in range(1000)),
+            )
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def server(shared_redis, monkeypatch):
+    server = Server()
+    client = httpx.Client(transport=httpx.MockTransport(server), follow_redirects=True)
+    monkeypatch.setattr(Image, "_http_client", client)
+    monkeypatch.setattr(Image, "_max_ingest_bytes", 64 * 1024)
+    yield server
+    client.close()
+
+
+def test_good_image_is_ingested(server):
+    image = Image.from_url("http://images.test/good.png", tags=["ingest"])
+    assert image.pk and image.tags == ["ingest"]
+    with ImageTools.open(io.BytesIO(image.read())) as img:
+        # center cropped to a square
+        assert img.format == "WEBP" and img.size == (64, 64)
+
+
+def test_redirect_is_followed(server):
+    image = Image.from_url("http://images.test/moved.png")
+    assert image and image.pk
+
+
+def test_wrong_content_type_is_refused(server):
+    before = Image.objects.count()
+    assert Image.from_url("http://images.test/page.html") is None
+    assert Image.objects.count() == before
+
+
+def test_declared_oversized_body_is_refused(server):
+    assert Image.from_url("http://images.test/declared-huge.png") is None
+
+
+def test_oversized_body_stops_streaming_at_the_limit(server):
+    assert Image.from_url("http://images.test/endless.png") is None
+    # 64 KiB limit in 1 KiB chunks: the rest of the body is never read
+    assert server.chunks_sent <= 65
+
+
+def test_missing_image_is_refused(server):
+    assert Image.from_url("http://images.test/missing.png") is None
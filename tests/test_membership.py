@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from autonomous.model.autoattr import ListAttr, ReferenceAttr, StringAttr
+from autonomous.model.automodel import AutoModel
+from models.user import User
+from utils.membership import MembershipIndex, MemoryBackend, RedisBackend
+
+
+class MembershipWorld(AutoModel):
+    name = StringAttr(default="")
+    users = ListAttr(ReferenceAttr(choices=[User]))
+
+
+class MembershipPlace(AutoModel):
+    world = ReferenceAttr(choices=[MembershipWorld])
+
+    def get_world(self):
+        return self.world
+
+
+@pytest.fixture
+def world():
+    user = User(name="member", email="member@example.com")
+    user.save()
+    world = MembershipWorld(name="world", users=[user])
+    world.save()
+    place = MembershipPlace(world=world)
+    place.save()
+    return user, world, place
+
+
+def _revoke(world):
+    # as another service would: the save hooks there invalidate its own index
+    world.users = []
+    world.save()
+
+
+def test_revocation_reaches_every_instance(shared_redis, world):
+    user, world, place = world
+    api, app = MembershipIndex(RedisBackend()), MembershipIndex(RedisBackend())
+    assert app.is_member(user, "membershipplace", place.pk)
+    _revoke(world)
+    api.invalidate(world)
+    assert not app.is_member(user, "membershipplace", place.pk)
+
+
+def test_memory_backend_revocation_is_bounded_by_its_ttl(world):
+    user, world, place = world
+    app = MembershipIndex(MemoryBackend(ttl=0.2))
+    assert app.is_member(user, "membershipplace", place.pk)
+    _revoke(world)
+    time.sleep(0.3)
+    assert not app.is_member(user, "membershipplace", place.pk)
+
+
+def test_from_env_shares_the_cache_when_redis_is_configured(monkeypatch):
+    monkeypatch.delenv("MEMBERSHIP_CACHE", raising=False)
+    monkeypatch.delenv("MEMBERSHIP_CACHE_TTL", raising=False)
+    monkeypatch.setenv("REDIS_HOST", "taskdb")
+    assert isinstance(MembershipIndex.from_env().backend, RedisBackend)
+    monkeypatch.delenv("REDIS_HOST")
+    backend = MembershipIndex.from_env().backend
+    assert isinstance(backend, MemoryBackend) and backend.entries.ttl <= 5
@@ -0,0 +1,33 @@
+import pytest
+from flask import Flask
+
+from utils import metrics
+
+
+@pytest.fixture
+def service(monkeypatch):
+    pytest.importorskip("prometheus_client")
+    monkeypatch.setattr(metrics, "enabled", True)
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+
+    def _service(public=False):
+        return metrics.install(Flask(__name__), public=public).test_client()
+
+    return _service
+
+
+def test_internal_service_exposes_metrics(service):
+    response = service().get("/metrics")
+    assert response.status_code == 200
+    assert b"http_request_duration_seconds" in response.data
+
+
+def test_public_service_needs_a_token(service, monkeypatch):
+    assert service(public=True).get("/metrics").status_code == 404
+    monkeypatch.setenv("METRICS_TOKEN", "s3cret")
+    client = service(public=True)
+    assert client.get("/metrics").status_code == 401
+    headers = {"Authorization": "Bearer wrong"}
+    assert client.get("/metrics", headers=headers).status_code == 401
+    headers = {"Authorization": "Bearer s3cret"}
+    assert client.get("/metrics", headers=headers).status_code == 200
@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+from models.image import Image
+
+
+@pytest.fixture
+def images(shared_redis):
+    Image.objects.delete()
+    images = [Image(tags=["page", "odd" if i % 2 else "even"]) for i in range(7)]
+    for image in images:
+        image.save()
+    return [str(image.pk) for image in images]
+
+
+def _page(client, **params):
+    response = client.post("/image/page", json=params)
+    pks = re.findall(r'id="gallery-([0-9a-f]{24})"', response.get_data(as_text=True))
+    return response, pks
+
+
+def _walk(client, **params):
+    pks, cursor = [], None
+    while True:
+        response, page = _page(client, cursor=cursor, **params)
+        assert response.status_code == 200
+        pks += page
+        if not (cursor := response.headers["X-Next-Cursor"]):
+            return pks
+
+
+def _walk_from(client, cursor, **params):
+    pks = []
+    while cursor:
+        response, page = _page(client, cursor=cursor, **params)
+        pks += page
+        cursor = response.headers["X-Next-Cursor"]
+    return pks
+
+
+def test_pages_cover_every_image_in_order(api_client, images):
+    assert _walk(api_client, limit=3) == images[::-1]
+    assert _walk(api_client, limit=3, order="oldest") == images
+
+
+def test_last_page_has_no_cursor(api_client, images):
+    response, pks = _page(api_client, limit=7)
+    assert len(pks) == 7 and response.headers["X-Next-Cursor"] == ""
+    assert "gallery-more" not in response.get_data(as_text=True)
+    response, pks = _page(api_client, limit=6)
+    assert response.headers["X-Next-Cursor"] == pks[-1]
+
+
+def test_cursor_is_stable_across_inserts(api_client, images):
+    response, first = _page(api_client, limit=3)
+    # newer images land before the first page, so the walk neither repeats
+    # nor skips any image
+    Image(tags=["page"]).save()
+    Image(tags=["page"]).save()
+    rest = _walk_from(api_client, response.headers["X-Next-Cursor"], limit=3)
+    assert first + rest == images[::-1]
+
+
+def test_tags_filter_pages(api_client, images):
+    assert _walk(api_client, limit=2, tags=["odd"], order="oldest") == images[1::2]
+    # a bare string is one tag, not its letters
+    assert _walk(api_client, limit=2, tags="odd", order="oldest") == images[1::2]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"cursor": "not-a-cursor"},
+        {"cursor": {"$gt": ""}},
+        {"limit": "many"},
+        {"limit": 0},
+        {"tags": 5},
+        {"tags": ["odd", None]},
+    ],
+)
+def test_malformed_requests_are_rejected(api_client, images, params):
+    assert api_client.post("/image/page", json=params).status_code == 400
+
+
+def test_invalid_get_cursor_is_rejected(api_client, images):
+    assert api_client.get("/image/page?cursor=zzz").status_code == 400
@@ -0,0 +1,52 @@
+import time
+
+import httpx
+import pytest
+
+from utils.resilience import GuardedClient
+
+
+class Backend:
+    """
+    Fails (or hangs) a set number of times before answering
+    """
+
+    def __init__(self, error=None, failures=10, delay=0):
+        self.error = error
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            if self.delay:
+                time.sleep(self.delay)
+            if self.error:
+                raise self.error
+        return f"image of {prompt}"
+
+
+def _guarded(backend):
+    return GuardedClient(backend, "test_backend", timeout=0.05, retries=2, backoff=0)
+
+
+def test_generate_is_not_retried_after_a_timeout(shared_redis):
+    backend = Backend(delay=0.2)
+    with pytest.raises(TimeoutError):
+        _guarded(backend).generate(prompt="castle")
+    assert backend.calls == 1
+
+
+def test_generate_is_retried_after_errors_nothing_was_made_for(shared_redis):
+    for error in (ConnectionError("refused"), httpx.ConnectTimeout("no route")):
+        backend = Backend(error=error, failures=2)
+        assert _guarded(backend).generate(prompt="castle") == "image of castle"
+        assert backend.calls == 3
+
+
+def test_idempotent_calls_are_retried_after_a_timeout(shared_redis):
+    backend = Backend(delay=0.2, failures=1)
+    client = _guarded(backend)
+    assert client.call(backend.generate, prompt="castle") == "image of castle"
+    assert backend.calls == 2
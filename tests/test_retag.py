@@ -0,0 +1,113 @@
+import pytest
+from bson import DBRef
+
+from autonomous.model.autoattr import ListAttr, ReferenceAttr, StringAttr
+from autonomous.model.automodel import AutoModel
+from models.image import Image
+from models.user import User
+
+
+class RetagWorld(AutoModel):
+    name = StringAttr(default="")
+    users = ListAttr(ReferenceAttr(choices=[User]))
+
+
+class RetagPlace(AutoModel):
+    world = ReferenceAttr(choices=[RetagWorld])
+
+    def get_world(self):
+        return self.world
+
+
+def _user(name, role="user"):
+    user = User(
+        name=name, email=f"{name}@example.com", state="authenticated", role=role
+    )
+    user.save()
+    return user
+
+
+def _image(tags, place=None):
+    image = Image(tags=tags)
+    image.save()
+    if place:
+        # as stored for ReferenceAttr(choices=["TTRPGBase"]) associations
+        Image._get_collection().update_one(
+            {"_id": image.pk},
+            {
+                "$set": {
+                    "associations": [
+                        {"_cls": "RetagPlace", "_ref": DBRef("retag_place", place.pk)}
+                    ]
+                }
+            },
+        )
+    return image
+
+
+@pytest.fixture
+def world():
+    member, outsider, admin = (
+        _user("member"),
+        _user("outsider"),
+        _user("admin", "admin"),
+    )
+    world = RetagWorld(name="world", users=[member])
+    world.save()
+    place = RetagPlace(world=world)
+    place.save()
+    return member, outsider, admin, place
+
+
+def _retag(client, user, images, **changes):
+    return client.post(
+        "/image/tags",
+        json={"user": str(user.pk), "pks": [str(i.pk) for i in images], **changes},
+    )
+
+
+def test_add_and_remove_in_one_request(api_client, world):
+    member, _, _, place = world
+    images = [
+        _image(["a", "b"], place),
+        _image(["b", "c"], place),
+        _image(["d"], place),
+    ]
+    response = _retag(api_client, member, images, add=["b", "e"], remove=["c", "d"])
+    assert response.status_code == 200
+    assert response.json == {"changed": 3, "selected": 3}
+    assert [sorted(Image.get(i.pk).tags) for i in images] == [
+        ["a", "b", "e"],
+        ["b", "e"],
+        ["b", "e"],
+    ]
+    # nothing left to change
+    response = _retag(api_client, member, images, add=["e"], remove=["d"])
+    assert response.json == {"changed": 0, "selected": 3}
+
+
+def test_only_members_may_retag(api_client, world):
+    member, outsider, admin, place = world
+    linked, loose = _image(["x"], place), _image(["x"])
+    assert _retag(api_client, outsider, [linked], add=["y"]).status_code == 403
+    assert _retag(api_client, member, [linked, loose], add=["y"]).status_code == 403
+    assert Image.get(linked.pk).tags == ["x"]
+    assert _retag(api_client, member, [linked], add=["y"]).status_code == 200
+    assert _retag(api_client, admin, [linked, loose], add=["z"]).status_code == 200
+    assert Image.get(loose.pk).tags == ["x", "z"]
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"pks": 5},
+        {"pks": "abc"},
+        {"pks": [1, 2]},
+        {"pks": [], "add": "castle"},
+        {"pks": [], "remove": {"tag": "castle"}},
+    ],
+)
+def test_malformed_payloads_are_rejected(api_client, world, payload):
+    admin = world[2]
+    response = api_client.post("/image/tags", json={"user": str(admin.pk), **payload})
+    assert response.status_code == 400
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+from PIL import Image as ImageTools
+
+from utils import transforms
+from utils.transforms import ImageTransform
+
+
+@pytest.fixture
+def img():
+    # asymmetric noise, so every rotation and flip gives a different image
+    noise = random.Random(7).randbytes(5 * 3 * 3)
+    return ImageTools.frombytes("RGB", (5, 3), noise)
+
+
+def _step_by_step(img, operations):
+    for name, kwargs in operations:
+        if name == "rotate":
+            img = img.rotate(kwargs["amount"], expand=True)
+        elif name == "flip":
+            if kwargs.get("horizontal", True):
+                img = img.transpose(ImageTools.Transpose.FLIP_LEFT_RIGHT)
+            if kwargs.get("vertical", True):
+                img = img.transpose(ImageTools.Transpose.FLIP_TOP_BOTTOM)
+        elif name == "crop":
+            img = img.crop(kwargs["box"])
+    return img
+
+
+def _same(a, b):
+    return a.size == b.size and a.tobytes() == b.tobytes()
+
+
+@pytest.mark.parametrize("amount", [90, -90, 180, 270, 360, -450])
+def test_float_angle_matches_int_angle(img, amount):
+    as_int = ImageTransform().rotate(amount).apply(img)
+    as_float = ImageTransform().rotate(float(amount)).apply(img)
+    assert _same(as_int, as_float)
+
+
+@pytest.mark.parametrize(
+    "operations",
+    [
+        [["rotate", {"amount": -90}], ["flip", {"vertical": False}]],
+        [["flip", {"horizontal": False}], ["rotate", {"amount": 90.0}]],
+        [
+            ["rotate", {"amount": 90}],
+            ["rotate", {"amount": 180}],
+            ["flip", {}],
+            ["crop", {"box": [0, 1, 2, 4]}],
+            ["rotate", {"amount": -90}],
+        ],
+    ],
+)
+def test_folded_chain_matches_each_step(img, operations):
+    assert _same(ImageTransform(operations).apply(img), _step_by_step(img, operations))
+
+
+@pytest.mark.parametrize(
+    "operations",
+    [
+        [["apply", {"img": None}]],
+        [["to_list", {}]],
+        [["rotate", {"amount": "90"}]],
+        [["crop", {"box": [0, 0, 5]}]],
+        [["resize", {"max_size": 0}]],
+        [["rotate", {"degrees": 90}]],
+        ["rotate"],
+    ],
+)
+def test_only_valid_operations_are_accepted(operations):
+    with pytest.raises(ValueError):
+        ImageTransform(operations)
+
+
+def test_bounds_are_checked_against_the_image(img, monkeypatch):
+    with pytest.raises(ValueError):
+        ImageTransform().crop((0, 0, 6, 3)).apply(img)
+    monkeypatch.setattr(transforms, "MAX_PIXELS", 16)
+    with pytest.raises(ValueError):
+        ImageTransform().rotate(45).apply(img)
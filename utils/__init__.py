@@ -0,0 +1 @@
+from utils.cache import LRUCache, SingleFlight
@@ -0,0 +1,307 @@
+import heapq
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from redis import RedisError
+
+from autonomous import log
+from autonomous.db import signals
+from utils.cache import LRUCache, SingleFlight
+from utils.connections import redis_connection, use_redis
+from utils.registry import model_classes
+
+
+class AutocompleteIndex:
+    """
+    In-memory prefix index over short texts. Every word of an entry is indexed
+    under each of its prefixes (up to max_prefix characters), and under its
+    trigrams for fuzzy matches when no entry matches every prefix.
+    """
+
+    def __init__(self, max_prefix=20):
+        self.max_prefix = max_prefix
+        self.entries = {}
+        self.prefixes = defaultdict(set)
+        self.trigrams = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"\w+", text.lower())
+
+    @staticmethod
+    def _trigrams(word):
+        return {word[i : i + 3] for i in range(len(word) - 2)}
+
+    def add(self, key, text):
+        with self._lock:
+            self.remove(key)
+            words = self.tokenize(text)
+            if not words:
+                return
+            self.entries[key] = (text.lower(), words)
+            for word in set(words):
+                for i in range(1, min(len(word), self.max_prefix) + 1):
+                    self.prefixes[word[:i]].add(key)
+                for trigram in self._trigrams(word):
+                    self.trigrams[trigram].add(key)
+
+    def remove(self, key):
+        with self._lock:
+            if entry := self.entries.pop(key, None):
+                for word in set(entry[1]):
+                    for i in range(1, min(len(word), self.max_prefix) + 1):
+                        self._discard(self.prefixes, word[:i], key)
+                    for trigram in self._trigrams(word):
+                        self._discard(self.trigrams, trigram, key)
+
+    @staticmethod
+    def _discard(postings, token, key):
+        if keys := postings.get(token):
+            keys.discard(key)
+            if not keys:
+                del postings[token]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.prefixes.clear()
+            self.trigrams.clear()
+
+    def search(self, query, k=10):
+        """
+        Returns up to k keys ranked by: whole text starts with the query,
+        earliest matching word, shortest text. Falls back to trigram overlap
+        if no entry has a word starting with every query token.
+        """
+        tokens = self.tokenize(query)
+        if not tokens:
+            return []
+        query = " ".join(tokens)
+        with self._lock:
+            postings = [self.prefixes.get(t[: self.max_prefix], set()) for t in tokens]
+            candidates = set.intersection(*postings) if all(postings) else set()
+            # tokens longer than max_prefix only narrowed the match to their prefix
+            if long_tokens := [t for t in tokens if len(t) > self.max_prefix]:
+                candidates = {
+                    key
+                    for key in candidates
+                    if all(
+                        any(w.startswith(t) for w in self.entries[key][1])
+                        for t in long_tokens
+                    )
+                }
+            if candidates:
+                return heapq.nsmallest(
+                    k, candidates, key=lambda key: self._rank(key, query, tokens)
+                )
+            overlap = Counter()
+            trigrams = set().union(*(self._trigrams(t) for t in tokens))
+            for trigram in trigrams:
+                overlap.update(self.trigrams.get(trigram, ()))
+            threshold = max(1, len(trigrams) // 2)
+            return heapq.nsmallest(
+                k,
+                (key for key, n in overlap.items() if n >= threshold),
+                key=lambda key: (-overlap[key], len(self.entries[key][0]), key),
+            )
+
+    def _rank(self, key, query, tokens):
+        text, words = self.entries[key]
+        position = next(
+            (i for i, w in enumerate(words) if w.startswith(tokens[0])), len(words)
+        )
+        return (not text.startswith(query), position, len(text), key)
+
+
+class Autocomplete:
+    """
+    Autocomplete over every AutoModel subclass that declares
+    `_autocomplete_fields`. Entries are keyed "<model>:<pk>".
+
+    The index is built on first use and kept current from the post_save,
+    post_bulk_insert and post_delete signals. Entries are also kept in a
+    Redis hash and changes are appended to a Redis stream, so workers in
+    every service share the index; AUTOCOMPLETE_REDIS=0 keeps it in process
+    (see utils.connections.use_redis). A new worker loads the hash instead of
+    scanning the collections, and replays the stream to pick up saves made
+    elsewhere.
+    """
+
+    entries_key = "autocomplete:entries"
+    changes_key = "autocomplete:changes"
+
+    def __init__(self):
+        self.index = AutocompleteIndex()
+        self.use_redis = use_redis("AUTOCOMPLETE_REDIS")
+        self.sync_interval = float(os.environ.get("AUTOCOMPLETE_SYNC_INTERVAL", 1))
+        self.max_changes = int(os.environ.get("AUTOCOMPLETE_MAX_CHANGES", 10000))
+        self.results = LRUCache(maxsize=1024, ttl=self.sync_interval)
+        self.flights = SingleFlight()
+        self._loaded = False
+        self._last_change = "0-0"
+        self._last_sync = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def models():
+        return [M for M in model_classes() if getattr(M, "_autocomplete_fields", None)]
+
+    @staticmethod
+    def key(obj):
+        return f"{type(obj).__name__.lower()}:{obj.pk}"
+
+    @staticmethod
+    def text(fields, values):
+        parts = []
+        for field in fields:
+            value = values.get(field)
+            parts += value if isinstance(value, list) else [value]
+        return " ".join(str(p) for p in parts if p)
+
+    ################### Loading #####################
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self.index.clear()
+            if self.use_redis:
+                try:
+                    self._load_redis()
+                except RedisError as e:
+                    log(f"==== Error: autocomplete falling back to the db: {e} ====")
+                    self._load_db()
+            else:
+                self._load_db()
+            self._loaded = True
+
+    def _load_db(self):
+        for Model in self.models():
+            fields = Model._autocomplete_fields
+            for doc in Model.objects.only(*fields).as_pymongo():
+                key = f"{Model.__name__.lower()}:{doc['_id']}"
+                self.index.add(key, self.text(fields, doc))
+
+    def _load_redis(self):
+        r = redis_connection()
+        # note the stream position first, so saves made while loading are replayed
+        latest = r.xrevrange(self.changes_key, count=1)
+        self._last_change = latest[0][0].decode() if latest else "0-0"
+        if r.exists(self.entries_key):
+            for key, text in r.hgetall(self.entries_key).items():
+                self.index.add(key.decode(), text.decode())
+        else:
+            self._load_db()
+            if entries := {k: v[0] for k, v in self.index.entries.items()}:
+                r.hset(self.entries_key, mapping=entries)
+
+    def sync(self):
+        """
+        Applies changes made by other workers, at most once per sync_interval
+        """
+        if (
+            not self.use_redis
+            or time.monotonic() - self._last_sync < self.sync_interval
+        ):
+            return
+        self._last_sync = time.monotonic()
+        try:
+            r = redis_connection()
+            oldest = r.xrange(self.changes_key, count=1)
+            if (
+                self._last_change != "0-0"
+                and oldest
+                and _stream_id(oldest[0][0].decode()) > _stream_id(self._last_change)
+            ):
+                # the stream was trimmed past our position; start over
+                self._loaded = False
+                self.load()
+                return
+            while batch := r.xread({self.changes_key: self._last_change}, count=1000):
+                for change_id, change in batch[0][1]:
+                    key = change[b"key"].decode()
+                    if text := change.get(b"text"):
+                        self.index.add(key, text.decode())
+                    else:
+                        self.index.remove(key)
+                    self._last_change = change_id.decode()
+        except RedisError as e:
+            log(f"==== Error: autocomplete sync failed: {e} ====")
+
+    ################### Updates #####################
+    def update(self, obj, deleted=False):
+        fields = getattr(type(obj), "_autocomplete_fields", None)
+        if not fields or not obj.pk:
+            return
+        key = self.key(obj)
+        text = (
+            "" if deleted else self.text(fields, {f: getattr(obj, f) for f in fields})
+        )
+        if self._loaded:
+            if text:
+                self.index.add(key, text)
+            else:
+                self.index.remove(key)
+        if self.use_redis:
+            try:
+                r = redis_connection()
+                if text:
+                    r.hset(self.entries_key, key, text)
+                else:
+                    r.hdel(self.entries_key, key)
+                r.xadd(
+                    self.changes_key,
+                    {"key": key, "text": text},
+                    maxlen=self.max_changes,
+                    approximate=True,
+                )
+            except RedisError as e:
+                log(f"==== Error: autocomplete update failed: {e} ====")
+
+    ################### Queries #####################
+    def search(self, query, k=10):
+        """
+        Returns up to k "<model>:<pk>" keys for query. Identical queries that
+        arrive together share one lookup, and results are reused for
+        sync_interval seconds.
+        """
+        query = " ".join(AutocompleteIndex.tokenize(query))
+        if (results := self.results.get((query, k))) is not None:
+            return results
+        return self.flights.do((query, k), self._search, query, k)
+
+    def _search(self, query, k):
+        self.load()
+        self.sync()
+        return self.results.set((query, k), self.index.search(query, k=k))
+
+
+def _stream_id(change_id):
+    return tuple(int(part) for part in change_id.split("-"))
+
+
+autocomplete = Autocomplete()
+
+
+def _on_save(sender, document, **kwargs):
+    autocomplete.update(document)
+
+
+def _on_bulk_insert(sender, documents, **kwargs):
+    for document in documents:
+        autocomplete.update(document)
+
+
+def _on_delete(sender, document, **kwargs):
+    autocomplete.update(document, deleted=True)
+
+
+signals.post_save.connect(_on_save)
+signals.post_bulk_insert.connect(_on_bulk_insert)
+signals.post_delete.connect(_on_delete)
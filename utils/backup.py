@@ -0,0 +1,251 @@
+"""
+backup.py - streaming, incremental database backups
+
+An archive is a gzip stream of BSON records, written and read one document
+at a time so neither side stages the dump on disk or in memory:
+
+    {"c": "__manifest__", "d": {"since": ..., "until": ..., "collections": [...]}}
+    {"c": <collection>, "d": <document>}       one per backed up document
+    {"c": <collection>, "ids": [<_id>, ...]}   incremental archives only
+
+Incremental archives only hold documents changed since the previous
+backup's watermark: AutoModel documents by `last_updated`, GridFS files by
+`uploadDate` (with the chunks of those files). They also list every _id
+still present, so a restore can drop documents deleted since. Collections
+with neither field are copied in full every time.
+
+AutoModel sets last_updated when a document is loaded, not when it is saved,
+so the watermark is moved back by BACKUP_OVERLAP seconds (default 3600) to
+catch documents saved a while after they were loaded. Restores are upserts,
+so the overlap only costs archive size.
+
+The watermark of a dump is only written to <state>.pending; `commit` moves
+it into place once the restore is known to have worked, so a failed restore
+is retried from the old watermark by the next backup.
+
+Usage (from a service directory, e.g. inside the api container):
+    python -m utils.backup dump --state dbbackups/state.json > dbbackups/db.bson.gz
+    python -m utils.backup restore --collections image fs < dbbackups/db.bson.gz
+    python -m utils.backup commit --state dbbackups/state.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+import bson
+
+from autonomous import log
+
+MANIFEST = "__manifest__"
+
+
+def _database():
+    # importing automodel registers the connection configured by DB_* variables
+    import autonomous.model.automodel  # noqa: F401
+    from autonomous.db.connection import get_db
+
+    return get_db()
+
+
+def _selected(name, collections):
+    """
+    `image` selects the image collection; `fs` selects the fs.files and
+    fs.chunks GridFS bucket
+    """
+    return not collections or any(
+        name == c or name.startswith(f"{c}.") for c in collections
+    )
+
+
+#################################################################
+#                            Dump                               #
+#################################################################
+
+
+def _changed(db, name, since):
+    """
+    The query for documents of `name` changed after `since`, or None if the
+    whole collection has to be copied
+    """
+    collection = db[name]
+    if name.endswith(".chunks"):
+        files = db[f"{name.removesuffix('.chunks')}.files"]
+        changed = [
+            f["_id"] for f in files.find({"uploadDate": {"$gt": since}}, {"_id": 1})
+        ]
+        return {"files_id": {"$in": changed}}
+    for field in ("last_updated", "uploadDate"):
+        if collection.find_one({field: {"$exists": True}}, {"_id": 1}):
+            return {field: {"$gt": since}}
+    return None
+
+
+def dump(out, db=None, since=None, collections=None, batch_size=1000):
+    """
+    Writes an archive of the database to the binary stream `out` and returns
+    its manifest. With `since`, only documents changed after it are written.
+    """
+    db = db if db is not None else _database()
+    # uploadDate is UTC, and so is last_updated in the (TZ-less) containers
+    until = datetime.now(timezone.utc)
+    if since:
+        since -= timedelta(seconds=float(os.environ.get("BACKUP_OVERLAP", 3600)))
+    names = sorted(n for n in db.list_collection_names() if _selected(n, collections))
+    manifest = {
+        "since": since,
+        "until": until,
+        "collections": names,
+        "database": db.name,
+    }
+    with gzip.GzipFile(fileobj=out, mode="wb") as archive:
+        archive.write(bson.encode({"c": MANIFEST, "d": manifest}))
+        for name in names:
+            query = _changed(db, name, since) if since else None
+            count = 0
+            for doc in db[name].find(query or {}, batch_size=batch_size):
+                archive.write(bson.encode({"c": name, "d": doc}))
+                count += 1
+            if query is not None:
+                # every id still present, so a restore can apply deletions
+                ids = []
+                for doc in db[name].find({}, {"_id": 1}, batch_size=batch_size * 10):
+                    ids.append(doc["_id"])
+                    if len(ids) == batch_size * 10:
+                        archive.write(bson.encode({"c": name, "ids": ids}))
+                        ids = []
+                archive.write(bson.encode({"c": name, "ids": ids}))
+            log(f"backup: {name}: {count} documents")
+    return manifest
+
+
+#################################################################
+#                           Restore                             #
+#################################################################
+
+
+def _replace(collection, docs):
+    # two round trips per batch instead of one upsert per document
+    collection.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    collection.insert_many(docs, ordered=False)
+
+
+def restore(stream, db=None, collections=None, workers=4, batch_size=1000, drop=False):
+    """
+    Applies an archive read from the binary stream `stream`. Documents are
+    upserted in batches by `workers` threads; at most 2 * workers batches are
+    held in memory. Returns the number of documents restored per collection.
+    """
+    db = db if db is not None else _database()
+    counts, batches, ids, pending = {}, {}, {}, set()
+
+    def _flush(pool, name):
+        if batch := batches.pop(name, None):
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when="FIRST_COMPLETED")
+                for future in done:
+                    pending.discard(future)
+                    future.result()
+            pending.add(pool.submit(_replace, db[name], batch))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with gzip.GzipFile(fileobj=stream, mode="rb") as archive:
+            for record in bson.decode_file_iter(archive):
+                name = record["c"]
+                if name == MANIFEST:
+                    manifest = record["d"]
+                    # an incremental archive only holds changes; never drop for it
+                    if drop and not manifest.get("since"):
+                        for collection in manifest["collections"]:
+                            if _selected(collection, collections):
+                                db.drop_collection(collection)
+                    continue
+                if not _selected(name, collections):
+                    continue
+                if "ids" in record:
+                    ids.setdefault(name, set()).update(record["ids"])
+                    continue
+                batches.setdefault(name, []).append(record["d"])
+                counts[name] = counts.get(name, 0) + 1
+                if len(batches[name]) >= batch_size:
+                    _flush(pool, name)
+        for name in list(batches):
+            _flush(pool, name)
+        wait(pending)
+        for future in pending:
+            future.result()
+
+    # incremental archives: remove what was deleted since the last backup
+    for name, keep in ids.items():
+        stale = [
+            d["_id"] for d in db[name].find({}, {"_id": 1}) if d["_id"] not in keep
+        ]
+        for start in range(0, len(stale), batch_size):
+            db[name].delete_many({"_id": {"$in": stale[start : start + batch_size]}})
+    return counts
+
+
+#################################################################
+#                             CLI                               #
+#################################################################
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            until = datetime.fromisoformat(json.load(f)["until"])
+    except (OSError, ValueError, KeyError):
+        return None
+    # watermarks written before they were made timezone aware are UTC
+    return until if until.tzinfo else until.replace(tzinfo=timezone.utc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m utils.backup")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dump_parser = commands.add_parser("dump", help="write an archive to stdout")
+    dump_parser.add_argument(
+        "--state", help="JSON file holding the watermark of the last backup"
+    )
+    dump_parser.add_argument(
+        "--full", action="store_true", help="ignore the watermark in --state"
+    )
+    restore_parser = commands.add_parser("restore", help="read an archive from stdin")
+    commit_parser = commands.add_parser(
+        "commit", help="make the watermark of the last dump the current one"
+    )
+    commit_parser.add_argument("--state", required=True)
+    restore_parser.add_argument("--workers", type=int, default=4)
+    restore_parser.add_argument("--drop", action="store_true")
+    for command in (dump_parser, restore_parser):
+        command.add_argument("--collections", nargs="*", help="default: all")
+    args = parser.parse_args(argv)
+
+    if args.command == "dump":
+        since = None if args.full or not args.state else _load_state(args.state)
+        manifest = dump(sys.stdout.buffer, since=since, collections=args.collections)
+        if args.state:
+            with open(f"{args.state}.pending", "w") as f:
+                json.dump({"until": manifest["until"].isoformat()}, f)
+    elif args.command == "commit":
+        try:
+            os.replace(f"{args.state}.pending", args.state)
+        except FileNotFoundError:
+            parser.error(f"no pending watermark for {args.state}")
+    else:
+        counts = restore(
+            sys.stdin.buffer,
+            collections=args.collections,
+            workers=args.workers,
+            drop=args.drop,
+        )
+        for name, count in sorted(counts.items()):
+            print(f"{name}: {count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
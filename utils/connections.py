@@ -0,0 +1,51 @@
+import os
+
+from redis import Redis
+
+_redis = None
+
+
+def redis_connection():
+    """
+    Shared Redis client, configured from the same REDIS_* variables as
+    autonomous' AutoTasks
+    """
+    global _redis
+    if not _redis:
+        options = {}
+        if username := os.environ.get("REDIS_USERNAME"):
+            options["username"] = username
+        if password := os.environ.get("REDIS_PASSWORD"):
+            options["password"] = password
+        _redis = Redis(
+            host=os.environ.get("REDIS_HOST", "taskdb"),
+            port=int(os.environ.get("REDIS_PORT", 6379)),
+            db=int(os.environ.get("REDIS_DB", 0)),
+            **options,
+        )
+    return _redis
+
+
+def use_redis(setting):
+    """
+    Whether shared state should go through Redis: the `setting` variable if
+    it is set, otherwise whenever REDIS_HOST is (AutoTasks needs it, so it is
+    set wherever tasks run)
+    """
+    value = os.environ.get(setting)
+    if value is None:
+        return bool(os.environ.get("REDIS_HOST"))
+    return value.lower() in ("1", "true", "yes", "redis")
+
+
+def release_mongo_client():
+    """
+    Closes the MongoClient while keeping its settings, so the next query
+    opens a new one. Called in the gunicorn master before forking, since a
+    MongoClient must not be shared across a fork.
+    """
+    from autonomous.db import connection
+
+    settings = dict(connection._connection_settings)
+    connection.disconnect_all()
+    connection._connection_settings.update(settings)
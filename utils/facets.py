@@ -0,0 +1,139 @@
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+from autonomous import log
+from utils.registry import model_class
+
+
+class TagFacets:
+    """
+    Counts of documents per tag for a model with a list of tags.
+
+    Unfiltered counts are read from a summary collection with one document
+    per tag, so they cost the same however many documents there are. The
+    model keeps the summary current by calling apply() with the tags each
+    save, delete or bulk write added and removed. Counts within a filter
+    (the tags found alongside every tag of the filter) are aggregated from
+    the model's collection through its tags index.
+
+    The summary is only kept once rebuild() has filled it and recorded so in
+    the facet_summaries collection; until then apply() does nothing, so the
+    first counts() (or a deploy running rebuild()) counts every stored
+    document rather than only those saved since.
+    """
+
+    def __init__(self, model, field="tags", collection=None, limit=100):
+        self.model = model
+        self.field = field
+        self.collection_name = collection or f"{model}_{field}_counts"
+        self.limit = int(os.environ.get("TAG_FACET_LIMIT", limit))
+        self._indexed = False
+        self._built = False
+
+    @property
+    def Model(self):
+        return model_class(self.model)
+
+    @property
+    def summary(self):
+        summary = self.Model._get_db()[self.collection_name]
+        if not self._indexed:
+            summary.create_index([("count", -1), ("_id", 1)])
+            self._indexed = True
+        return summary
+
+    @property
+    def markers(self):
+        return self.Model._get_db()["facet_summaries"]
+
+    def built(self):
+        if not self._built:
+            self._built = bool(self.markers.find_one({"_id": self.collection_name}))
+        return self._built
+
+    ################### Updates #####################
+    def apply(self, added=(), removed=()):
+        """
+        Adds one to the count of every tag in `added` and takes one from
+        every tag in `removed`; either may repeat a tag or be a Counter.
+        Does nothing until the summary has been built.
+        """
+        if not self.built():
+            return
+        delta = Counter(added)
+        delta.subtract(Counter(removed))
+        if not (delta := {tag: n for tag, n in delta.items() if n}):
+            return
+        summary = self.summary
+        for tag, n in delta.items():
+            summary.update_one({"_id": tag}, {"$inc": {"count": n}}, upsert=True)
+        if any(n < 0 for n in delta.values()):
+            summary.delete_many({"_id": {"$in": list(delta)}, "count": {"$lte": 0}})
+
+    def rebuild(self):
+        """
+        Recounts every tag from the model's collection. Changes applied while
+        it runs may be lost, so run it when the summary is first needed or
+        after writes that bypass the model (restores, manual edits).
+        """
+        counts = list(
+            self.Model._get_collection().aggregate(
+                [
+                    {"$unwind": f"${self.field}"},
+                    {"$group": {"_id": f"${self.field}", "count": {"$sum": 1}}},
+                ]
+            )
+        )
+        summary = self.summary
+        summary.delete_many({})
+        if counts:
+            summary.insert_many(counts)
+        self.markers.update_one(
+            {"_id": self.collection_name},
+            {"$set": {"built": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        self._built = True
+        log(f"=== Tag facets: rebuilt {len(counts)} {self.model} tags ===")
+        return len(counts)
+
+    ################### Queries #####################
+    def counts(self, tags=None, limit=None):
+        """
+        Returns (total, [(tag, count), ...]) by descending count. With
+        `tags`, total is the number of documents having all of them and
+        the counts are of the other tags on those documents.
+        """
+        limit = limit or self.limit
+        if tags:
+            return self._filtered(tags, limit)
+        if not self.built():
+            self.rebuild()
+        summary = self.summary
+        total = self.Model._get_collection().estimated_document_count()
+        return total, [
+            (doc["_id"], doc["count"])
+            for doc in summary.find().sort([("count", -1), ("_id", 1)]).limit(limit)
+        ]
+
+    def _filtered(self, tags, limit):
+        collection = self.Model._get_collection()
+        # the queryset's query includes _cls, which prefixes the model's indexes
+        match = self.Model.objects(**{f"{self.field}__all": list(tags)})._query
+        total = collection.count_documents(match)
+        counts = collection.aggregate(
+            [
+                {"$match": match},
+                {"$project": {self.field: 1}},
+                {"$unwind": f"${self.field}"},
+                {"$match": {self.field: {"$nin": list(tags)}}},
+                {"$group": {"_id": f"${self.field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": limit},
+            ]
+        )
+        return total, [(doc["_id"], doc["count"]) for doc in counts]
+
+
+tag_facets = TagFacets("image")
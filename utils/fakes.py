@@ -0,0 +1,55 @@
+import hashlib
+import io
+import random
+import threading
+import time
+
+from PIL import Image as ImageTools
+
+
+class FakeImageAgent:
+    """
+    Offline stand-in for autonomous' ImageAgent. Returns a WEBP of smooth
+    noise derived from the prompt, so the same prompt always gives the same
+    image and different prompts give images that are not near duplicates.
+
+    calls and max_in_flight count the generate calls made and the most that
+    ran at once.
+
+    Usage:
+        Image._client = FakeImageAgent(delay=0.1)
+    """
+
+    def __init__(self, delay=0, size=1024, fail_on=None):
+        self.delay = delay
+        self.size = size
+        self.fail_on = fail_on
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.fail_on and self.fail_on in prompt:
+                raise RuntimeError(f"FakeImageAgent refused prompt: {prompt}")
+            if self.delay:
+                time.sleep(self.delay)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        # smooth noise seeded by the prompt: distinct prompts give distinct
+        # perceptual hashes, where solid colours would all hash to 0
+        noise = random.Random(hashlib.md5(prompt.encode()).digest()).randbytes(
+            16 * 16 * 3
+        )
+        img = ImageTools.frombytes("RGB", (16, 16), noise).resize(
+            (self.size, self.size), ImageTools.Resampling.BICUBIC
+        )
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format="WEBP")
+        return img_byte_arr.getvalue()
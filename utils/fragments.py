@@ -0,0 +1,166 @@
+import os
+
+from flask import get_template_attribute
+from jinja2 import TemplateNotFound
+from redis import RedisError
+
+from autonomous import log
+from autonomous.db import signals
+from utils.cache import LRUCache
+from utils.connections import redis_connection, use_redis
+
+
+class MemoryBackend:
+    """
+    Per-process backend. Instead of counting generations, a save drops the
+    object's fragments directly. Saves made by other processes or services
+    only show up once the cached fragment's ttl runs out.
+    """
+
+    def __init__(self, maxsize=2048, ttl=30):
+        self.fragments = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.fragments.get(key)
+
+    def set(self, key, html):
+        self.fragments.set(key, html)
+
+    def generation(self, key):
+        return 0
+
+    def bump(self, key):
+        # "fragment:gen:<model>:<pk>" -> fragment keys containing ":<model>:<pk>:"
+        obj_key = f":{key.split(':', 2)[-1]}:"
+        self.fragments.prune(lambda k: obj_key in k)
+
+
+class RedisBackend:
+    """
+    Backend shared by every service, so a save anywhere invalidates the
+    fragments rendered by the api
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+    def get(self, key):
+        if html := redis_connection().get(key):
+            return html.decode()
+
+    def set(self, key, html):
+        redis_connection().set(key, html, ex=self.ttl)
+
+    def generation(self, key):
+        return int(redis_connection().get(key) or 0)
+
+    def bump(self, key):
+        # once every fragment keyed on the old generation has expired, the
+        # counter can expire too: a reset to 0 can then match nothing stale
+        pipe = redis_connection().pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.ttl * 2)
+        pipe.execute()
+
+
+class FragmentCache:
+    """
+    Caches macros rendered for a (user, obj) pair. Keys include a generation
+    counter for the user and for the object, bumped whenever either is saved
+    or deleted. Templates and macros that do not exist are remembered for a
+    while so the lookup is not retried on every request.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.missing = LRUCache(maxsize=256, ttl=300)
+
+    @classmethod
+    def from_env(cls):
+        """
+        The Redis backend wherever Redis is configured (see
+        utils.connections.use_redis), so saves in other services invalidate
+        the fragments; otherwise a per-process memory backend with a short ttl
+        """
+        ttl = os.environ.get("FRAGMENT_CACHE_TTL")
+        if use_redis("FRAGMENT_CACHE"):
+            return cls(RedisBackend(ttl=int(ttl or 300)))
+        backend = os.environ.get("FRAGMENT_CACHE", "memory").lower()
+        if backend == "memory":
+            return cls(MemoryBackend(ttl=float(ttl or 30)))
+        return cls()
+
+    @staticmethod
+    def _generation_key(obj, model=None):
+        model = model or type(obj).__name__.lower()
+        return f"fragment:gen:{model}:{obj.pk}"
+
+    def render(self, template, macro, user, obj=None, args=None, default=""):
+        """
+        Returns the macro called with `args` (default: user, obj), rendering
+        it only on a cache miss. Returns `default` if the template or macro
+        does not exist.
+        """
+        if self.missing.get((template, macro)):
+            return default
+        key = None
+        if self.backend:
+            try:
+                generation = (
+                    self.backend.generation(self._generation_key(obj)) if obj else 0
+                )
+                # session users are not User documents; key them as one
+                user_generation = (
+                    self.backend.generation(self._generation_key(user, "user"))
+                    if user
+                    else 0
+                )
+                key = ":".join(
+                    str(part)
+                    for part in (
+                        "fragment",
+                        template,
+                        macro,
+                        "user",
+                        user.pk if user else None,
+                        user_generation,
+                        type(obj).__name__.lower(),
+                        obj.pk if obj else None,
+                        generation,
+                    )
+                )
+                if (html := self.backend.get(key)) is not None:
+                    return html
+            except RedisError as e:
+                log(f"==== Error: fragment cache unavailable: {e} ====")
+                key = None
+        try:
+            fragment = get_template_attribute(template, macro)
+        except (TemplateNotFound, AttributeError):
+            self.missing.set((template, macro), True)
+            return default
+        html = str(fragment(*(args if args is not None else (user, obj))))
+        if key:
+            try:
+                self.backend.set(key, html)
+            except RedisError as e:
+                log(f"==== Error: fragment cache unavailable: {e} ====")
+        return html
+
+    def invalidate(self, obj):
+        if self.backend and obj.pk:
+            try:
+                self.backend.bump(self._generation_key(obj))
+            except RedisError as e:
+                log(f"==== Error: fragment cache unavailable: {e} ====")
+
+
+fragment_cache = FragmentCache.from_env()
+
+
+def _invalidate(sender, document, **kwargs):
+    fragment_cache.invalidate(document)
+
+
+signals.post_save.connect(_invalidate)
+signals.post_delete.connect(_invalidate)
@@ -0,0 +1,168 @@
+import os
+
+from redis import RedisError
+
+from autonomous import log
+from autonomous.db import signals
+from utils.cache import LRUCache
+from utils.connections import redis_connection, use_redis
+from utils.registry import model_class
+
+
+class MemoryBackend:
+    """
+    Per-process backend. Saves made by other processes only show up once
+    the cached entry's ttl runs out.
+    """
+
+    def __init__(self, maxsize=4096, ttl=5):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_world(self, key):
+        return self.entries.get(("world", key))
+
+    def set_world(self, key, world_key):
+        self.entries.set(("world", key), world_key)
+
+    def is_member(self, world_key, user_pk):
+        if (members := self.entries.get(("members", world_key))) is not None:
+            return user_pk in members
+
+    def set_members(self, world_key, members):
+        self.entries.set(("members", world_key), frozenset(members))
+
+    def forget(self, key):
+        self.entries.pop(("world", key))
+        self.entries.pop(("members", key))
+
+
+class RedisBackend:
+    """
+    Backend shared by every service. Member sets are Redis sets, so the
+    check is a single SISMEMBER.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+    def get_world(self, key):
+        if world_key := redis_connection().get(f"membership:world:{key}"):
+            return world_key.decode()
+
+    def set_world(self, key, world_key):
+        redis_connection().set(f"membership:world:{key}", world_key, ex=self.ttl)
+
+    def is_member(self, world_key, user_pk):
+        key = f"membership:members:{world_key}"
+        pipe = redis_connection().pipeline()
+        pipe.exists(key)
+        pipe.sismember(key, user_pk)
+        exists, member = pipe.execute()
+        if exists:
+            return bool(member)
+
+    def set_members(self, world_key, members):
+        key = f"membership:members:{world_key}"
+        pipe = redis_connection().pipeline()
+        pipe.delete(key)
+        # a placeholder keeps an empty member set distinguishable from a miss
+        pipe.sadd(key, "", *members)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def forget(self, key):
+        redis_connection().delete(
+            f"membership:world:{key}", f"membership:members:{key}"
+        )
+
+
+class MembershipIndex:
+    """
+    Answers "is this user a member of the world that owns (model, pk)?"
+    without loading the object or its world on a hit. Two things are cached:
+    the world that owns each object, and the set of member pks of each
+    world. Saving or deleting a document drops both entries for it, so a
+    change to a world's users takes effect on the next check.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    @classmethod
+    def from_env(cls):
+        """
+        The Redis backend wherever Redis is configured (see
+        utils.connections.use_redis), since worlds change in other services;
+        otherwise a per-process memory backend whose short ttl bounds how
+        long a removed member keeps access
+        """
+        ttl = os.environ.get("MEMBERSHIP_CACHE_TTL")
+        if use_redis("MEMBERSHIP_CACHE"):
+            return cls(RedisBackend(ttl=int(ttl or 300)))
+        backend = os.environ.get("MEMBERSHIP_CACHE", "memory").lower()
+        if backend == "memory":
+            return cls(MemoryBackend(ttl=float(ttl or 5)))
+        return cls()
+
+    @staticmethod
+    def _key(model, pk):
+        return f"{model.lower()}:{pk}"
+
+    def is_member(self, user, model, pk):
+        if not user or not model or not pk:
+            return False
+        user_pk = str(user.pk)
+        key = self._key(model if isinstance(model, str) else model.__name__, pk)
+        if self.backend:
+            try:
+                if world_key := self.backend.get_world(key):
+                    if (
+                        member := self.backend.is_member(world_key, user_pk)
+                    ) is not None:
+                        return member
+            except RedisError as e:
+                log(f"==== Error: membership cache unavailable: {e} ====")
+        return self._load(key, model, pk, user_pk)
+
+    def _load(self, key, model, pk, user_pk):
+        Model = model_class(model)
+        obj = Model.get(pk) if Model else None
+        world = obj.get_world() if hasattr(obj, "get_world") else None
+        if not world:
+            return False
+        # read the raw references instead of dereferencing every user
+        doc = type(world).objects(pk=world.pk).only("users").as_pymongo().first()
+        members = {_ref_pk(ref) for ref in (doc or {}).get("users", [])}
+        if self.backend:
+            world_key = self._key(type(world).__name__, world.pk)
+            try:
+                self.backend.set_world(key, world_key)
+                self.backend.set_members(world_key, members)
+            except RedisError as e:
+                log(f"==== Error: membership cache unavailable: {e} ====")
+        return user_pk in members
+
+    def invalidate(self, obj):
+        if self.backend and obj.pk:
+            try:
+                self.backend.forget(self._key(type(obj).__name__, obj.pk))
+            except RedisError as e:
+                log(f"==== Error: membership cache unavailable: {e} ====")
+
+
+def _ref_pk(ref):
+    # generic references are stored as {"_cls": ..., "_ref": DBRef(...)}
+    if isinstance(ref, dict):
+        ref = ref.get("_ref")
+    return str(getattr(ref, "id", ref))
+
+
+membership = MembershipIndex.from_env()
+
+
+def _invalidate(sender, document, **kwargs):
+    membership.invalidate(document)
+
+
+signals.post_save.connect(_invalidate)
+signals.post_delete.connect(_invalidate)
@@ -0,0 +1,358 @@
+import hmac
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, has_request_context, request
+
+# Everything here is a no-op unless METRICS_ENABLED is set, and
+# prometheus_client is only imported when it is.
+enabled = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class _Metrics:
+    def __init__(self):
+        from prometheus_client import Counter, Gauge, Histogram
+
+        self.requests = Histogram(
+            "http_request_duration_seconds",
+            "Time to the response headers, per route",
+            ["service", "method", "route", "status"],
+        )
+        self.request_commands = Histogram(
+            "http_request_mongo_commands",
+            "Mongo commands sent while handling one request",
+            ["service", "route"],
+            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+        )
+        self.request_gridfs = Histogram(
+            "http_request_gridfs_bytes",
+            "GridFS chunk bytes read or written while handling one request",
+            ["service", "route"],
+            buckets=(0, 1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 22, 1 << 24),
+        )
+        self.commands = Histogram(
+            "mongo_command_duration_seconds",
+            "Mongo command round trips",
+            ["command", "status"],
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+        )
+        self.gridfs = Counter(
+            "gridfs_bytes", "GridFS chunk bytes read and written", ["direction"]
+        )
+        self.upstream = Histogram(
+            "upstream_request_duration_seconds",
+            "Proxied requests, up to the upstream's response headers",
+            ["upstream", "method", "status"],
+        )
+        self.jobs = Histogram(
+            "rq_job_duration_seconds",
+            "RQ job run time",
+            ["job", "status"],
+            buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+        )
+        self.backend_calls = Histogram(
+            "backend_call_duration_seconds",
+            "Attempts at guarded backend calls (utils/resilience.py)",
+            ["backend", "outcome"],
+            buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+        )
+        self.backend_retries = Counter(
+            "backend_retries",
+            "Guarded calls retried after a transient error",
+            ["backend"],
+        )
+        self.backend_rejected = Counter(
+            "backend_rejected",
+            "Guarded calls not made, by reason (circuit_open, rate_limited)",
+            ["backend", "reason"],
+        )
+        self.backend_wait = Histogram(
+            "backend_rate_limit_wait_seconds",
+            "Time guarded calls waited for a rate limit token",
+            ["backend"],
+            buckets=(0, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+        )
+        self.backend_circuit = Gauge(
+            "backend_circuit_state",
+            "Circuit breaker state last seen: 0 closed, 1 half open, 2 open",
+            ["backend"],
+            multiprocess_mode="livemax",
+        )
+        self.backend_transitions = Counter(
+            "backend_circuit_transitions",
+            "Circuit breakers opening and closing",
+            ["backend", "state"],
+        )
+
+
+def _get():
+    global _metrics
+    if not _metrics:
+        with _metrics_lock:
+            if not _metrics:
+                _metrics = _Metrics()
+    return _metrics
+
+
+def _count_request(name, amount=1):
+    if has_request_context() and "metrics_start" in g:
+        setattr(g, name, getattr(g, name, 0) + amount)
+
+
+#################################################################
+#                            Mongo                              #
+#################################################################
+
+
+def _mongo_listener():
+    from pymongo import monitoring
+
+    class MongoListener(monitoring.CommandListener):
+        """
+        Times every command and counts the GridFS chunk bytes that go through
+        it. Chunk reads are matched to their replies by request id.
+        """
+
+        def __init__(self):
+            self.chunk_reads = {}
+
+        def started(self, event):
+            _count_request("metrics_commands")
+            name = event.command_name
+            collection = event.command.get("collection" if name == "getMore" else name)
+            if not isinstance(collection, str) or not collection.endswith(".chunks"):
+                return
+            if name == "insert":
+                size = sum(len(d.get("data", b"")) for d in event.command["documents"])
+                _get().gridfs.labels("write").inc(size)
+                _count_request("metrics_gridfs", size)
+            elif name in ("find", "getMore"):
+                self.chunk_reads[event.request_id] = True
+
+        def succeeded(self, event):
+            _get().commands.labels(event.command_name, "ok").observe(
+                event.duration_micros / 1e6
+            )
+            if self.chunk_reads.pop(event.request_id, None):
+                cursor = event.reply.get("cursor", {})
+                batch = cursor.get("firstBatch") or cursor.get("nextBatch") or []
+                size = sum(len(d.get("data", b"")) for d in batch)
+                _get().gridfs.labels("read").inc(size)
+                _count_request("metrics_gridfs", size)
+
+        def failed(self, event):
+            _get().commands.labels(event.command_name, "error").observe(
+                event.duration_micros / 1e6
+            )
+            self.chunk_reads.pop(event.request_id, None)
+
+    return MongoListener()
+
+
+_listening = False
+
+
+def _listen_to_mongo():
+    """
+    Listeners only apply to clients created after they are registered, so
+    the client opened at import is released and reopened on the next query
+    """
+    global _listening
+    with _metrics_lock:
+        if _listening:
+            return
+        from pymongo import monitoring
+
+        from utils.connections import release_mongo_client
+
+        monitoring.register(_mongo_listener())
+        release_mongo_client()
+        _listening = True
+
+
+#################################################################
+#                             RQ                                #
+#################################################################
+
+
+class _QueueCollector:
+    """
+    Reads queue depths from Redis at scrape time
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+        from rq import Queue
+
+        queued = GaugeMetricFamily(
+            "rq_queue_depth", "Jobs waiting in each queue", labels=["queue"]
+        )
+        started = GaugeMetricFamily(
+            "rq_queue_started", "Jobs running from each queue", labels=["queue"]
+        )
+        failed = GaugeMetricFamily(
+            "rq_queue_failed", "Failed jobs kept for each queue", labels=["queue"]
+        )
+        for queue in Queue.all(connection=self.connection):
+            queued.add_metric([queue.name], queue.count)
+            started.add_metric([queue.name], queue.started_job_registry.count)
+            failed.add_metric([queue.name], queue.failed_job_registry.count)
+        yield from (queued, started, failed)
+
+
+def timed_job(func):
+    """
+    Records how long the wrapped RQ job ran. Jobs run in the rq worker
+    process, so their durations reach /metrics when the worker shares the
+    service's PROMETHEUS_MULTIPROC_DIR.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start, status = time.perf_counter(), "failed"
+        try:
+            result = func(*args, **kwargs)
+            status = "finished"
+            return result
+        finally:
+            _get().jobs.labels(func.__name__, status).observe(
+                time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+#################################################################
+#                           Upstreams                           #
+#################################################################
+
+
+def observe_upstream(name, method, status, seconds):
+    if enabled:
+        _get().upstream.labels(name, method, status).observe(seconds)
+
+
+#################################################################
+#                           Backends                            #
+#################################################################
+
+_circuit_states = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def observe_backend(name, outcome, seconds):
+    if enabled:
+        _get().backend_calls.labels(name, outcome).observe(seconds)
+
+
+def backend_retry(name):
+    if enabled:
+        _get().backend_retries.labels(name).inc()
+
+
+def backend_rejected(name, reason):
+    if enabled:
+        _get().backend_rejected.labels(name, reason).inc()
+
+
+def backend_waited(name, seconds):
+    if enabled:
+        _get().backend_wait.labels(name).observe(seconds)
+
+
+def backend_circuit(name, state, transition=False):
+    if enabled:
+        _get().backend_circuit.labels(name).set(_circuit_states[state])
+        if transition:
+            _get().backend_transitions.labels(name, state).inc()
+
+
+#################################################################
+#                            Flask                              #
+#################################################################
+
+
+def _registry(collectors):
+    from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        registry = REGISTRY
+    else:
+        # every gunicorn worker writes its own files; merge them per scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    for collector in collectors:
+        if collector not in getattr(registry, "_collector_to_names", {}):
+            registry.register(collector)
+    return registry
+
+
+def install(app, rq_connection=None, public=False):
+    """
+    Adds request timing and a /metrics endpoint to `app`. Does nothing
+    unless METRICS_ENABLED is set.
+
+    When METRICS_TOKEN is set, /metrics answers only scrapes sending it as a
+    bearer token. A public service (one reachable from outside the internal
+    network) only gets the endpoint if the token is set.
+    """
+    if not enabled:
+        return app
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+    metrics = _get()
+    _listen_to_mongo()
+    service = app.config.get("APP_NAME") or app.name
+    collectors = [_QueueCollector(rq_connection)] if rq_connection else []
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_commands = 0
+        g.metrics_gridfs = 0
+
+    @app.after_request
+    def _observe(response):
+        if "metrics_start" in g:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            metrics.requests.labels(
+                service, request.method, route, response.status_code
+            ).observe(time.perf_counter() - g.metrics_start)
+            metrics.request_commands.labels(service, route).observe(g.metrics_commands)
+            metrics.request_gridfs.labels(service, route).observe(g.metrics_gridfs)
+        return response
+
+    token = os.environ.get("METRICS_TOKEN", "")
+
+    def metrics_endpoint():
+        if token and not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {token}".encode(),
+        ):
+            return Response(status=401, headers={"WWW-Authenticate": "Bearer"})
+        return Response(
+            generate_latest(_registry(collectors)), mimetype=CONTENT_TYPE_LATEST
+        )
+
+    if token or not public:
+        app.add_url_rule("/metrics", "metrics", metrics_endpoint)
+    return app
+
+
+def mark_process_dead(pid):
+    """
+    gunicorn child_exit hook helper for multiprocess mode
+    """
+    if enabled and "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
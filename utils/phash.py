@@ -0,0 +1,113 @@
+import io
+
+from PIL import Image as ImageTools
+
+# 64 bit hashes split into BANDS equal parts. Two hashes within BANDS - 1 bits
+# of each other share at least one part exactly, so an index on the parts
+# finds every near duplicate within that distance (multi-index hashing).
+BITS = 64
+BANDS = 4
+# flat or evenly shaded images hash to (nearly) all zeros or all ones, so
+# every such image would match every other; their hashes are not compared
+MIN_BITS = 8
+
+
+def dhash(img, size=8):
+    """
+    Difference hash of a PIL image: a size x (size + 1) greyscale thumbnail,
+    one bit per pixel that is brighter than its right neighbour. Stable under
+    re-encoding, scaling and small colour changes.
+    """
+    img = img.convert("L").resize((size + 1, size), ImageTools.Resampling.LANCZOS)
+    pixels = img.tobytes()
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = (value << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return value
+
+
+def dhash_bytes(raw_data, size=8):
+    with ImageTools.open(io.BytesIO(raw_data)) as img:
+        # hashing only needs a thumbnail; let JPEG decode at a reduced scale
+        img.draft("L", (size * 8, size * 8))
+        return dhash(img, size=size)
+
+
+def to_hex(value):
+    return f"{value:0{BITS // 4}x}"
+
+
+def from_hex(text):
+    return int(text, 16)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def comparable(value):
+    """
+    Whether a hash carries enough detail to be compared with others
+    """
+    return value is not None and MIN_BITS <= value.bit_count() <= BITS - MIN_BITS
+
+
+def bands(value):
+    """
+    The indexed parts of a hash, tagged with their position
+    """
+    width = BITS // BANDS
+    mask = (1 << width) - 1
+    return [
+        f"{i}:{(value >> (width * (BANDS - 1 - i))) & mask:0{width // 4}x}"
+        for i in range(BANDS)
+    ]
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over hashes in Hamming space. search() only descends
+    into children whose edge distance is within `distance` of the query's
+    distance to their parent, which skips most of the tree for small distances.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, key):
+        self.size += 1
+        node = (value, key, {})
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            d = hamming(value, current[0])
+            if d not in current[2]:
+                current[2][d] = node
+                return
+            current = current[2][d]
+
+    def search(self, value, distance):
+        """
+        Returns [(distance, key)] for every hash within `distance`, nearest first
+        """
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= distance:
+                results.append((d, node[1]))
+            stack.extend(
+                child
+                for edge, child in node[2].items()
+                if d - distance <= edge <= d + distance
+            )
+        return sorted(results, key=lambda r: r[0])
@@ -0,0 +1,47 @@
+import importlib
+import pkgutil
+
+from autonomous.model.automodel import AutoModel
+
+_imported = False
+
+
+def _import_models():
+    """
+    Imports every module of the models package, once. Services only import
+    the models their routes use, so lookups by name would otherwise miss the
+    rest.
+    """
+    global _imported
+    if not _imported:
+        import models
+
+        for module in pkgutil.iter_modules(models.__path__):
+            importlib.import_module(f"models.{module.name}")
+        _imported = True
+
+
+def model_classes():
+    """
+    Every concrete AutoModel subclass in the models package
+    """
+    _import_models()
+    subclasses, models = AutoModel.__subclasses__(), []
+    while subclasses:
+        subclass = subclasses.pop()
+        subclasses += subclass.__subclasses__()
+        if not subclass._meta.get("abstract"):
+            models.append(subclass)
+    return models
+
+
+def model_class(name):
+    """
+    Looks up a model by its lowercased class name. Unlike
+    AutoModel.load_model, an unknown name returns None.
+    """
+    if not isinstance(name, str):
+        return name
+    return next(
+        (M for M in model_classes() if M.__name__.lower() == name.lower()), None
+    )
@@ -0,0 +1,315 @@
+"""
+renditions.py - batch rendition builds
+
+Builds the Image._sizes renditions of many images at once. Originals are
+read in chunks and copied into one shared memory block per chunk; a pool of
+worker processes decodes and thumbnails them straight from the block, so
+only offsets are pickled on the way in. The renditions of a whole chunk are
+written back with one insert into each collection of the GridFS bucket.
+
+Saved images also get their renditions ahead of the first request: enqueue()
+queues one precompute job per new image version on the RENDITION_QUEUE RQ
+queue, which the renditions service works through with --worker.
+
+Usage (from a service directory, e.g. inside the tasks container):
+    python -m utils.renditions --all            # backfill missing renditions
+    python -m utils.renditions --all --force    # rebuild every rendition
+    python -m utils.renditions <pk> [<pk> ...] --workers 4
+    python -m utils.renditions --worker         # run precompute jobs
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+
+from bson import ObjectId
+from gridfs import DEFAULT_CHUNK_SIZE
+from redis import RedisError
+
+from autonomous import log
+from utils.connections import redis_connection
+from utils.metrics import timed_job
+
+_workers = int(os.environ.get("RENDITION_WORKERS", 0)) or os.cpu_count() or 1
+_chunk_size = int(os.environ.get("RENDITION_CHUNK", 64))
+
+# precompute jobs queued on save; past queue_limit waiting jobs, new images
+# are left to get their renditions on first request
+_precompute = os.environ.get("RENDITION_PRECOMPUTE", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+_queue_name = os.environ.get("RENDITION_QUEUE", "renditions")
+_queue_limit = int(os.environ.get("RENDITION_QUEUE_LIMIT", 1000))
+_queued_ttl = int(os.environ.get("RENDITION_QUEUED_TTL", 3600))
+
+
+def _render(name, offset, length):
+    """
+    Runs in a worker: renders the original held at [offset, offset + length)
+    of the shared memory block `name`
+    """
+    from models.image import Image
+
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        with block.buf[offset : offset + length] as raw_data:
+            return Image.render_renditions(raw_data)
+    finally:
+        block.close()
+
+
+def _bucket(Image):
+    # _rendition_fs() also makes sure the bucket is indexed
+    Image._rendition_fs()
+    db, name = Image._get_db(), Image._rendition_collection
+    return db[f"{name}.files"], db[f"{name}.chunks"]
+
+
+def _complete(Image, images):
+    """
+    The images that already have every rendition of their current version
+    """
+    have = {
+        (f["image"], f["version"], f["size"])
+        for f in _bucket(Image)[0].find(
+            {"image": {"$in": [str(i.pk) for i in images]}},
+            {"image": 1, "version": 1, "size": 1},
+        )
+    }
+    return {
+        image.pk
+        for image in images
+        if all(
+            (str(image.pk), image.version, size) in have
+            for size in Image._sizes.values()
+        )
+    }
+
+
+def _store(Image, results):
+    """
+    Replaces the renditions of every (image, {size: bytes}) in `results`.
+    Chunks are inserted before the files that reference them, and the old
+    files are only deleted afterwards, so readers never see a gap.
+    """
+    files, chunks = _bucket(Image)
+    stale = [
+        f["_id"]
+        for f in files.find(
+            {"image": {"$in": [str(image.pk) for image, _ in results]}}, {"_id": 1}
+        )
+    ]
+    new_files, new_chunks = [], []
+    now = datetime.now(timezone.utc)
+    for image, renditions in results:
+        for size, rendition in renditions.items():
+            file_id = ObjectId()
+            new_chunks += [
+                {
+                    "files_id": file_id,
+                    "n": n,
+                    "data": rendition[start : start + DEFAULT_CHUNK_SIZE],
+                }
+                for n, start in enumerate(range(0, len(rendition), DEFAULT_CHUNK_SIZE))
+            ]
+            new_files.append(
+                {
+                    "_id": file_id,
+                    "filename": image.rendition_name(size),
+                    "contentType": "image/webp",
+                    "length": len(rendition),
+                    "chunkSize": DEFAULT_CHUNK_SIZE,
+                    "uploadDate": now,
+                    "image": str(image.pk),
+                    "version": image.version,
+                    "size": size,
+                }
+            )
+    if new_files:
+        chunks.insert_many(new_chunks, ordered=False)
+        files.insert_many(new_files, ordered=False)
+    if stale:
+        files.delete_many({"_id": {"$in": stale}})
+        chunks.delete_many({"files_id": {"$in": stale}})
+
+
+def build(pks=None, force=False, workers=None, chunk_size=None, progress=None):
+    """
+    Builds the renditions of the images `pks`, or of every image. Unless
+    `force`, images that already have all of theirs are skipped, as are pks
+    that are not ObjectIds (counted as invalid).
+    progress(done, total) is called after each chunk.
+
+    Returns {"built": n, "skipped": n, "failed": n, "invalid": n, "total": n}
+    """
+    from models.image import Image
+
+    chunk_size = chunk_size or _chunk_size
+    invalid = 0
+    if pks is None:
+        query = {}
+    else:
+        pks = list(pks)
+        valid = [str(pk) for pk in pks if ObjectId.is_valid(str(pk))]
+        if invalid := len(pks) - len(valid):
+            log(f"==== Error: skipping {invalid} invalid image pks ====")
+        query = {"_id": {"$in": [ObjectId(pk) for pk in valid]}}
+    ids = [d["_id"] for d in Image._get_collection().find(query, {"_id": 1})]
+    counts = {
+        "built": 0,
+        "skipped": 0,
+        "failed": 0,
+        "invalid": invalid,
+        "total": len(ids),
+    }
+
+    with ProcessPoolExecutor(max_workers=workers or _workers) as pool:
+        for start in range(0, len(ids), chunk_size):
+            images = list(
+                Image.objects(pk__in=ids[start : start + chunk_size]).only(
+                    "data", "data_hash"
+                )
+            )
+            done = set() if force else _complete(Image, images)
+            originals = [
+                (image, raw_data)
+                for image in images
+                if image.pk not in done and (raw_data := image.read())
+            ]
+            counts["skipped"] += len(images) - len(originals)
+            if originals:
+                block = shared_memory.SharedMemory(
+                    create=True, size=sum(len(raw) for _, raw in originals)
+                )
+                try:
+                    futures, offset = [], 0
+                    for image, raw_data in originals:
+                        block.buf[offset : offset + len(raw_data)] = raw_data
+                        futures.append(
+                            pool.submit(_render, block.name, offset, len(raw_data))
+                        )
+                        offset += len(raw_data)
+                    results = []
+                    for (image, _), future in zip(originals, futures):
+                        try:
+                            results.append((image, future.result()))
+                        except Exception as e:
+                            log(f"==== Error: renditions of {image.pk}: {e} ====")
+                            counts["failed"] += 1
+                finally:
+                    block.close()
+                    block.unlink()
+                if results:
+                    _store(Image, results)
+                    counts["built"] += len(results)
+            if progress:
+                progress(min(start + chunk_size, len(ids)), len(ids))
+    return counts
+
+
+#################################################################
+#                          Precompute                           #
+#################################################################
+
+
+def _queued_key(pk, version):
+    return f"renditions:queued:{pk}:{version}"
+
+
+def enqueue(images):
+    """
+    Queues a precompute job for each image whose current version has none
+    queued yet, so repeated saves of an image queue one job. Returns the
+    number of jobs queued.
+    """
+    images = [i for i in images if i and i.pk and i.data] if _precompute else []
+    if not images:
+        return 0
+    from rq import Queue
+
+    queued = 0
+    try:
+        connection = redis_connection()
+        queue = Queue(_queue_name, connection=connection)
+        if (waiting := queue.count) + len(images) > _queue_limit:
+            log(f"==== Renditions: {waiting} jobs waiting, not queueing more ====")
+            return 0
+        for image in images:
+            key = _queued_key(image.pk, image.version)
+            if connection.set(key, 1, nx=True, ex=_queued_ttl):
+                queue.enqueue(
+                    "utils.renditions.precompute",
+                    str(image.pk),
+                    image.version,
+                    result_ttl=0,
+                    failure_ttl=_queued_ttl,
+                )
+                queued += 1
+    except RedisError as e:
+        log(f"==== Error: unable to queue renditions: {e} ====")
+    return queued
+
+
+@timed_job
+def precompute(pk, version):
+    """
+    RQ job: builds the renditions of one image version in the worker's own
+    process. Skips versions that have since been replaced (their
+    replacement has its own job) or already have every rendition.
+    """
+    from models.image import Image
+
+    redis_connection().delete(_queued_key(pk, version))
+    image = Image.objects(pk=pk).only("data", "data_hash").first()
+    if not image or image.version != version or _complete(Image, [image]):
+        return False
+    if raw_data := image.read():
+        _store(Image, [(image, Image.render_renditions(raw_data))])
+        return True
+    return False
+
+
+def work():
+    from rq import Worker
+
+    Worker([_queue_name], connection=redis_connection()).work()
+
+
+#################################################################
+#                             CLI                               #
+#################################################################
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m utils.renditions")
+    parser.add_argument("pks", nargs="*", help="image pks to build")
+    parser.add_argument("--all", action="store_true", help="every image")
+    parser.add_argument("--force", action="store_true", help="rebuild existing")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk", type=int, default=None, help="images per chunk")
+    parser.add_argument("--worker", action="store_true", help="run precompute jobs")
+    args = parser.parse_args(argv)
+    if args.worker:
+        return work()
+    if not args.pks and not args.all:
+        parser.error("pass image pks, --all or --worker")
+
+    def _progress(done, total):
+        print(f"{done}/{total}", flush=True)
+
+    counts = build(
+        pks=None if args.all else args.pks,
+        force=args.force,
+        workers=args.workers,
+        chunk_size=args.chunk,
+        progress=_progress,
+    )
+    print(counts)
+
+
+if __name__ == "__main__":
+    main()
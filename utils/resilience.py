@@ -0,0 +1,379 @@
+"""
+resilience.py - guarded calls to slow or flaky backends
+
+GuardedClient wraps a backend client (the ImageAgent behind Image._agent())
+so that every call
+    - waits for a token from a rate limit shared by every process through
+      Redis, or gives up after <ENV>_RATE_WAIT seconds
+    - fails fast while the backend's circuit breaker is open
+    - is abandoned after <ENV>_TIMEOUT seconds
+    - is retried with exponential backoff and jitter after transient errors
+      (timeouts, connection errors, 408/409/429/5xx responses, empty results)
+      Generation calls are not idempotent, so they are not retried after a
+      timeout: the abandoned attempt may still finish and be billed.
+
+RQ runs every job in a fresh process, so the limiter and breaker state lives
+in Redis rather than in the process. If Redis is unreachable both let calls
+through, so a Redis outage does not stop the backend from being used.
+"""
+
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import httpx
+from redis import RedisError, WatchError
+
+from autonomous import log
+from utils import metrics
+from utils.connections import redis_connection
+
+
+class BackendError(Exception):
+    """
+    A backend call that failed or returned nothing
+    """
+
+
+class BackendUnavailable(BackendError):
+    """
+    A call that was not made: the circuit is open or the rate limit wait
+    would have been too long
+    """
+
+
+def _setting(env, name, default, cast=float):
+    return cast(os.environ.get(f"{env}_{name}", default))
+
+
+def _transient(e):
+    """
+    Whether a retry could succeed: the backend was slow, unreachable,
+    overloaded or rate limiting, rather than refusing the request itself
+    """
+    if isinstance(e, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(e, BackendError):
+        return not isinstance(e, BackendUnavailable)
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in (408, 409, 429) or (status or 0) >= 500
+
+
+def _retryable(e, idempotent):
+    """
+    Whether to retry after `e`. A call that is not idempotent is not retried
+    once it timed out after being sent, since the backend may still complete
+    the abandoned attempt (and a generation would be made and billed twice).
+    """
+    if (
+        not idempotent
+        and isinstance(e, (TimeoutError, httpx.TimeoutException))
+        and not isinstance(e, httpx.ConnectTimeout)
+    ):
+        return False
+    return _transient(e)
+
+
+def call_with_timeout(timeout, func, *args, **kwargs):
+    """
+    Runs func on a daemon thread and waits at most `timeout` seconds for it.
+    A call that times out is abandoned, not interrupted: its thread runs on
+    until the backend answers, but the caller is free.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future.result(timeout)
+
+
+#################################################################
+#                         Rate limiting                         #
+#################################################################
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average and bursts of up to `capacity`,
+    across every process sharing the Redis instance. The bucket is one hash
+    of (tokens, stamp), updated in a WATCH/MULTI transaction.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.key = f"ratelimit:{name}"
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+
+    def take(self):
+        """
+        Takes a token if one is available. Returns 0, or the seconds until
+        the next token if there was none.
+        """
+        if self.rate <= 0:
+            return 0
+        with redis_connection().pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    tokens, stamp = pipe.hmget(self.key, "tokens", "stamp")
+                    now = time.time()
+                    if tokens is None or stamp is None:
+                        tokens = self.capacity
+                    else:
+                        tokens = min(
+                            self.capacity,
+                            float(tokens) + max(now - float(stamp), 0) * self.rate,
+                        )
+                    wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+                    pipe.multi()
+                    pipe.hset(
+                        self.key,
+                        mapping={
+                            "tokens": tokens - 1 if not wait else tokens,
+                            "stamp": now,
+                        },
+                    )
+                    # an idle bucket is full again by then, so let it expire
+                    pipe.expire(self.key, math.ceil(self.capacity / self.rate) + 1)
+                    pipe.execute()
+                    return wait
+                except WatchError:
+                    continue
+
+    def acquire(self, max_wait):
+        """
+        Blocks until a token is taken. Returns the seconds waited, or raises
+        BackendUnavailable if that would take longer than `max_wait`.
+        """
+        start = time.monotonic()
+        while wait := self.take():
+            if time.monotonic() - start + wait > max_wait:
+                raise BackendUnavailable(f"{self.key}: rate limited")
+            time.sleep(wait)
+        return time.monotonic() - start
+
+
+#################################################################
+#                        Circuit breaker                        #
+#################################################################
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` transient failures within `window` seconds with
+    no success in between. While open, calls fail fast; after `cooldown`
+    seconds it is half open and lets a single probe call through, whose
+    outcome closes the circuit or opens it again.
+
+    Keys, all under breaker:<name>:
+        failures  recent failure count, expiring after `window`
+        open      set while open, expiring after `cooldown`
+        tripped   set from opening until a success closes the circuit
+        probe     held by the half open probe call
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name, threshold=5, window=60, cooldown=30, probe_timeout=120):
+        self.name = name
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+
+    def _key(self, part):
+        return f"breaker:{self.name}:{part}"
+
+    def state(self):
+        connection = redis_connection()
+        if connection.exists(self._key("open")):
+            return self.OPEN
+        if connection.exists(self._key("tripped")):
+            return self.HALF_OPEN
+        return self.CLOSED
+
+    def allow(self):
+        """
+        Whether a call may be made now; in the half open state only the
+        caller that wins the probe may
+        """
+        state = self.state()
+        metrics.backend_circuit(self.name, state)
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            return bool(
+                redis_connection().set(
+                    self._key("probe"), 1, nx=True, ex=math.ceil(self.probe_timeout)
+                )
+            )
+        return False
+
+    def release(self):
+        """
+        Gives up the half open probe without a result
+        """
+        redis_connection().delete(self._key("probe"))
+
+    def succeeded(self):
+        connection = redis_connection()
+        if connection.delete(self._key("tripped")):
+            log(f"==== {self.name}: circuit closed ====")
+            metrics.backend_circuit(self.name, self.CLOSED, transition=True)
+        connection.delete(self._key("failures"), self._key("probe"))
+
+    def failed(self):
+        connection = redis_connection()
+        if connection.exists(self._key("tripped")):
+            # the half open probe failed
+            return self._open()
+        failures = connection.incr(self._key("failures"))
+        if failures == 1:
+            connection.expire(self._key("failures"), math.ceil(self.window))
+        if failures >= self.threshold:
+            self._open()
+
+    def _open(self):
+        connection = redis_connection()
+        connection.set(self._key("open"), 1, ex=math.ceil(self.cooldown))
+        connection.set(self._key("tripped"), 1)
+        connection.delete(self._key("failures"), self._key("probe"))
+        log(f"==== {self.name}: circuit open for {self.cooldown}s ====")
+        metrics.backend_circuit(self.name, self.OPEN, transition=True)
+
+
+#################################################################
+#                            Client                             #
+#################################################################
+
+
+class GuardedClient:
+    """
+    Wraps `client` so that its calls go through the rate limit, circuit
+    breaker, timeout and retries described above. Settings are read from
+    <env>_* variables, falling back to the keyword arguments:
+
+        TIMEOUT            seconds per attempt
+        RETRIES            attempts after the first
+        BACKOFF            base delay; attempt n waits up to BACKOFF * 2**n
+        BACKOFF_MAX        cap on a single delay
+        RATE               calls per minute across every process; 0 for none
+        BURST              calls allowed at once after an idle spell
+        RATE_WAIT          longest wait for a rate limit token
+        BREAKER_FAILURES   failures that open the circuit
+        BREAKER_WINDOW     seconds in which those failures must happen
+        BREAKER_COOLDOWN   seconds the circuit stays open
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        env=None,
+        timeout=120,
+        retries=3,
+        backoff=1,
+        backoff_max=30,
+        rate=0,
+        burst=1,
+        rate_wait=60,
+        breaker_failures=5,
+        breaker_window=60,
+        breaker_cooldown=30,
+    ):
+        env = env or name.upper()
+        self.client = client
+        self.name = name
+        self.timeout = _setting(env, "TIMEOUT", timeout)
+        self.retries = _setting(env, "RETRIES", retries, int)
+        self.backoff = _setting(env, "BACKOFF", backoff)
+        self.backoff_max = _setting(env, "BACKOFF_MAX", backoff_max)
+        self.rate_wait = _setting(env, "RATE_WAIT", rate_wait)
+        self.bucket = TokenBucket(
+            name, _setting(env, "RATE", rate) / 60, _setting(env, "BURST", burst)
+        )
+        self.breaker = CircuitBreaker(
+            name,
+            threshold=_setting(env, "BREAKER_FAILURES", breaker_failures, int),
+            window=_setting(env, "BREAKER_WINDOW", breaker_window),
+            cooldown=_setting(env, "BREAKER_COOLDOWN", breaker_cooldown),
+            probe_timeout=self.timeout,
+        )
+
+    def generate(self, *args, **kwargs):
+        return self.call(self.client.generate, *args, idempotent=False, **kwargs)
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        """
+        Calls func(*args, **kwargs) until it succeeds, fails with an error a
+        retry would not fix, or runs out of retries; the last error is raised.
+        Unless `idempotent`, a timed out call is not retried.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(func, *args, **kwargs)
+            except Exception as e:
+                if attempt >= self.retries or not _retryable(e, idempotent):
+                    raise
+                delay = random.uniform(
+                    0, min(self.backoff_max, self.backoff * 2**attempt)
+                )
+                attempt += 1
+                log(f"==== {self.name}: {e!r}; retry {attempt} in {delay:.1f}s ====")
+                metrics.backend_retry(self.name)
+                time.sleep(delay)
+
+    def _admit(self):
+        """
+        Raises BackendUnavailable unless the breaker allows a call and a rate
+        limit token is taken in time
+        """
+        try:
+            if not self.breaker.allow():
+                metrics.backend_rejected(self.name, "circuit_open")
+                raise BackendUnavailable(f"{self.name}: circuit open")
+            try:
+                metrics.backend_waited(self.name, self.bucket.acquire(self.rate_wait))
+            except BackendUnavailable:
+                self.breaker.release()
+                metrics.backend_rejected(self.name, "rate_limited")
+                raise
+        except RedisError as e:
+            log(f"==== Error: {self.name} limits unavailable, calling anyway: {e} ====")
+
+    def _attempt(self, func, *args, **kwargs):
+        self._admit()
+        start = time.perf_counter()
+        try:
+            result = call_with_timeout(self.timeout, func, *args, **kwargs)
+            if result is None:
+                raise BackendError(f"{self.name}: empty response")
+        except Exception as e:
+            outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+            metrics.observe_backend(self.name, outcome, time.perf_counter() - start)
+            # a refused request still shows the backend is up
+            self._record(healthy=not _transient(e))
+            raise
+        metrics.observe_backend(self.name, "ok", time.perf_counter() - start)
+        self._record(healthy=True)
+        return result
+
+    def _record(self, healthy):
+        try:
+            if healthy:
+                self.breaker.succeeded()
+            else:
+                self.breaker.failed()
+        except RedisError as e:
+            log(f"==== Error: {self.name} breaker unavailable: {e} ====")
@@ -0,0 +1,164 @@
+import math
+import os
+from numbers import Real
+
+from PIL import Image as ImageTools
+
+# the largest image any step of a transform may produce
+MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", 50_000_000))
+
+# Rotations by multiples of 90 degrees and flips, as 2x2 matrices acting on
+# pixel coordinates (y pointing down). Composing them gives another member of
+# the same set, so any run of them collapses into a single transpose.
+_ORTHOGONAL = {
+    ((1, 0), (0, 1)): None,
+    ((-1, 0), (0, 1)): ImageTools.Transpose.FLIP_LEFT_RIGHT,
+    ((1, 0), (0, -1)): ImageTools.Transpose.FLIP_TOP_BOTTOM,
+    ((0, 1), (-1, 0)): ImageTools.Transpose.ROTATE_90,
+    ((-1, 0), (0, -1)): ImageTools.Transpose.ROTATE_180,
+    ((0, -1), (1, 0)): ImageTools.Transpose.ROTATE_270,
+    ((0, 1), (1, 0)): ImageTools.Transpose.TRANSPOSE,
+    ((0, -1), (-1, 0)): ImageTools.Transpose.TRANSVERSE,
+}
+_IDENTITY = ((1, 0), (0, 1))
+_FLIP_LEFT_RIGHT = ((-1, 0), (0, 1))
+_FLIP_TOP_BOTTOM = ((1, 0), (0, -1))
+_ROTATE_90 = ((0, 1), (-1, 0))
+
+
+def _compose(first, then):
+    """
+    matrix for applying `first` and then `then`
+    """
+    return tuple(
+        tuple(sum(then[i][k] * first[k][j] for k in range(2)) for j in range(2))
+        for i in range(2)
+    )
+
+
+class ImageTransform:
+    """
+    A chain of rotate/flip/crop/resize operations applied to a decoded image
+    in one pass. Consecutive quarter-turn rotations and flips are folded into
+    a single transpose.
+
+    Usage:
+        ImageTransform().rotate(-90).flip(vertical=False).resize(600).apply(img)
+    """
+
+    def __init__(self, operations=None):
+        """
+        operations: [[name, {kwargs}], ...] as produced by to_list(), e.g.
+        from request JSON; raises ValueError for anything else
+        """
+        self.operations = []
+        for operation in operations or []:
+            try:
+                name, kwargs = operation
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid operation {operation!r}")
+            if (
+                not isinstance(name, str)
+                or name not in self.OPERATIONS
+                or not isinstance(kwargs, dict)
+            ):
+                raise ValueError(f"Invalid operation {operation!r}")
+            try:
+                self.OPERATIONS[name](self, **kwargs)
+            except TypeError as e:
+                raise ValueError(f"Invalid arguments for {name}: {e}")
+
+    def __bool__(self):
+        return bool(self.operations)
+
+    def to_list(self):
+        """
+        JSON serializable form, accepted by ImageTransform(operations)
+        """
+        return [[name, dict(kwargs)] for name, kwargs in self.operations]
+
+    def rotate(self, amount=-90):
+        if isinstance(amount, bool) or not isinstance(amount, Real):
+            raise ValueError("Invalid rotation. Must be a number of degrees.")
+        self.operations.append(("rotate", {"amount": amount}))
+        return self
+
+    def flip(self, horizontal=True, vertical=True):
+        self.operations.append(
+            ("flip", {"horizontal": bool(horizontal), "vertical": bool(vertical)})
+        )
+        return self
+
+    def crop(self, box):
+        """
+        box: (left, upper, right, lower) within the image at that step
+        """
+        try:
+            box = tuple(int(v) for v in box)
+        except (TypeError, ValueError):
+            box = ()
+        if len(box) != 4 or box[0] >= box[2] or box[1] >= box[3]:
+            raise ValueError("Invalid crop box. Must be (left, upper, right, lower).")
+        self.operations.append(("crop", {"box": box}))
+        return self
+
+    def resize(self, max_size):
+        try:
+            max_size = int(max_size)
+        except (TypeError, ValueError):
+            max_size = 0
+        if max_size <= 0:
+            raise ValueError("Invalid max_size value. Must be a positive integer.")
+        self.operations.append(("resize", {"max_size": max_size}))
+        return self
+
+    # the only methods a serialized chain may name
+    OPERATIONS = {"rotate": rotate, "flip": flip, "crop": crop, "resize": resize}
+
+    def apply(self, img):
+        """
+        raises ValueError if a crop box falls outside the image it is applied
+        to, or a step would produce more than MAX_PIXELS pixels
+        """
+        _check_size(*img.size)
+        matrix = _IDENTITY
+        for name, kwargs in self.operations:
+            if name == "rotate" and kwargs["amount"] % 90 == 0:
+                for _ in range((int(kwargs["amount"]) // 90) % 4):
+                    matrix = _compose(matrix, _ROTATE_90)
+            elif name == "flip":
+                if kwargs["horizontal"]:
+                    matrix = _compose(matrix, _FLIP_LEFT_RIGHT)
+                if kwargs["vertical"]:
+                    matrix = _compose(matrix, _FLIP_TOP_BOTTOM)
+            else:
+                img = self._transpose(img, matrix)
+                matrix = _IDENTITY
+                if name == "rotate":
+                    angle = math.radians(kwargs["amount"])
+                    cos, sin = abs(math.cos(angle)), abs(math.sin(angle))
+                    width, height = img.size
+                    _check_size(width * cos + height * sin, width * sin + height * cos)
+                    img = img.rotate(kwargs["amount"], expand=True)
+                elif name == "crop":
+                    left, upper, right, lower = kwargs["box"]
+                    width, height = img.size
+                    if left < 0 or upper < 0 or right > width or lower > height:
+                        raise ValueError(
+                            f"Crop box {kwargs['box']} is outside the {width}x{height} image"
+                        )
+                    img = img.crop(kwargs["box"])
+                elif name == "resize":
+                    img.thumbnail((kwargs["max_size"], kwargs["max_size"]))
+        return self._transpose(img, matrix)
+
+    @staticmethod
+    def _transpose(img, matrix):
+        if (method := _ORTHOGONAL[matrix]) is not None:
+            return img.transpose(method)
+        return img
+
+
+def _check_size(width, height):
+    if math.ceil(width) * math.ceil(height) > MAX_PIXELS:
+        raise ValueError(f"Transformed image would exceed {MAX_PIXELS} pixels")